@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import argparse
+import gc
+import importlib
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+def import_consumer(lib_path: str, module_name: str):
+    """Import the consumer's main.py (and its plib.py) from lib_path."""
+    sys.path.insert(0, str(Path(lib_path).resolve()))
+    return importlib.import_module(module_name)
+
+def measure(prepare, data, process_data=None):
+    """
+    Prepare one process_data argument from `data` and return (elapsed_ms, heap_retained_bytes, heap_peak_bytes).
+    - heap_retained_bytes: heap still held by the prepared argument once it is built.
+    - process_data: when given, the app also runs on the prepared argument inside the measurement.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    arg = prepare(data)
+    retained, _ = tracemalloc.get_traced_memory()
+    if process_data is not None:
+        process_data(arg)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del arg
+    return elapsed_ms, retained, peak
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare ARGUMENT_MODE copy (deep copies) and view (lazy read-only views) for process_data (time and Python heap)."
+    )
+    parser.add_argument("lib_path", help="Directory containing the consumer main.py and plib.py (e.g. docker/gramine_consumer/code_eval_02).")
+    parser.add_argument("module_name", help="Module name of the consumer main.py (e.g. main).")
+    parser.add_argument("data_files", nargs="+", help="JSON data files passed as the argument (e.g. docker/provider/svm_data/10k.json).")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of measurements per mode.")
+    parser.add_argument("--with-processing", action="store_true", help="Also run process_data on the prepared argument.")
+
+    args = parser.parse_args()
+
+    consumer = import_consumer(args.lib_path, args.module_name)
+    process_data = consumer.process_data if args.with_processing else None
+
+    for data_file in args.data_files:
+        with open(data_file, "r") as f:
+            data = json.load(f)
+
+        heap = {}
+        for mode in ("copy", "view"):
+            # same path as request(): prepare_argument under the given ARGUMENT_MODE
+            consumer.ARGUMENT_MODE = mode
+            for _ in range(args.repeat):
+                start = datetime.now()
+                elapsed_ms, retained, peak = measure(consumer.prepare_argument, data, process_data)
+                end = datetime.now()
+                heap[mode] = (max(heap.get(mode, (0, 0))[0], retained), max(heap.get(mode, (0, 0))[1], peak))
+                print(
+                    f"___BENCH___ Argument passing (Start:{start.strftime('%Y-%m-%d %H:%M:%S')}, End:{end.strftime('%Y-%m-%d %H:%M:%S')}, "
+                    f"Duration_ms:{elapsed_ms:.3f}, file:{Path(data_file).name}, mode:{mode}, "
+                    f"heap_retained_kb:{retained / 1024:.1f}, heap_peak_kb:{peak / 1024:.1f})"
+                )
+
+        # copy minus view; a negative value means view mode used more heap
+        print(
+            f"{Path(data_file).name}: heap difference copy - view per argument: "
+            f"retained {(heap['copy'][0] - heap['view'][0]) / 1024:.1f} KiB, peak {(heap['copy'][1] - heap['view'][1]) / 1024:.1f} KiB"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,10 @@ import socket
 import ssl
 import argparse
 import os
+import struct
 import sys
 import time 
+import zlib
 
 # ===== TLS settings and constants =====
 
@@ -16,6 +18,14 @@ ISSUE_PORT  = 8001   # for certificate issuance
 TOKEN_PORT  = 8002   # for token-driven processing
 
 RETRY_MAX   = 20
+
+# framed protocol (must match the consumer's main.py)
+FRAME_MAGIC      = b"VDDP"
+FRAME_VERSION    = 1
+FRAME_HEADER     = struct.Struct("!4sBBQ")
+RESPONSE_FRAME   = struct.Struct("!BBI")
+FRAME_COMPRESSED = 0x01
+FRAME_END        = 0x02
 # =====================================
 
 def create_context(cache_dir: str) -> ssl.SSLContext:
@@ -74,10 +84,45 @@ def tls_gencert(cache_dir: str, consumer: str, port: int):
     print(f"Connect {consumer}:{port} ...")
     run_with_retry(_attempt, f"gencert ({consumer}:{port})")
 
-def tls_process(path_token: str, cache_dir: str, consumer: str, port: int):
+def recv_exact(tls_socket, size: int) -> bytearray:
+    """Read exactly `size` bytes into one buffer; raise if the server closes the connection first."""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    n = 0
+    while n < size:
+        read = tls_socket.recv_into(view[n:], size - n)
+        if read == 0:
+            raise ConnectionError("Connection closed in the middle of a frame")
+        n += read
+    return buf
+
+def send_framed(tls_socket, tokens: bytes, compress: bool):
+    """Send all tokens as a single request frame (optionally zlib-compressed)."""
+    flags = 0
+    if compress:
+        tokens = zlib.compress(tokens)
+        flags |= FRAME_COMPRESSED
+    tls_socket.sendall(FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, len(tokens)) + tokens)
+
+def recv_framed(tls_socket):
+    """Yield response messages as they are streamed back, until the end-of-stream frame."""
+    while True:
+        version, flags, length = RESPONSE_FRAME.unpack(recv_exact(tls_socket, RESPONSE_FRAME.size))
+        if version != FRAME_VERSION:
+            raise ValueError(f"Unsupported protocol version: {version}")
+        payload = recv_exact(tls_socket, length)
+        if flags & FRAME_COMPRESSED:
+            payload = zlib.decompress(payload)
+        if flags & FRAME_END:
+            return
+        yield payload.decode()
+
+def tls_process(path_token: str, cache_dir: str, consumer: str, port: int, framed: bool = False, compress: bool = False):
     """
     Send tokens over TLS (port 8002) to trigger server-side data processing.
     The server uses the information in the token file to run its processing program.
+    - framed: use the length-prefixed protocol; each response message is printed as soon as its frame arrives.
+    - compress: compress the token payload (framed only); the server then compresses large responses too.
     """
     if not os.path.isfile(path_token):
         print(f"ERROR: tokens file not found: {path_token}", file=sys.stderr)
@@ -101,6 +146,12 @@ def tls_process(path_token: str, cache_dir: str, consumer: str, port: int):
         try:
             with context.wrap_socket(client_socket, server_hostname=consumer) as tls_socket:
                 tls_socket.connect((consumer, port))
+                if framed:
+                    send_framed(tls_socket, tokens, compress)
+                    for msg in recv_framed(tls_socket):
+                        print(f"Received: {msg}")
+                    return
+
                 tls_socket.send(str(lines_count).encode())
                 tls_socket.send(tokens)
 
@@ -135,13 +186,15 @@ def main():
     p_process.add_argument("cache_dir", help="Path to the cache directory containing consumer.crt, consumer.key, and RootCA.pem.")
     p_process.add_argument("consumer", help="Host to use for the processing interface.")
     p_process.add_argument("port", type=int, help="Port to use for the processing interface.")
+    p_process.add_argument("--framed", action="store_true", help="Use the length-prefixed framed protocol.")
+    p_process.add_argument("--compress", action="store_true", help="Compress the token payload (with --framed).")
 
     args = parser.parse_args()
 
     if args.mode == "gencert":
         tls_gencert(args.cache_dir, args.consumer, args.port)
     elif args.mode == "process":
-        tls_process(args.path_token, args.cache_dir, args.consumer, args.port)
+        tls_process(args.path_token, args.cache_dir, args.consumer, args.port, args.framed, args.compress)
 
 if __name__ == "__main__":
     main()
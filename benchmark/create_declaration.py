@@ -3,6 +3,7 @@ from OpenSSL import crypto
 import base64
 import json
 import requests
+import sys
 
 from datetime import datetime, timedelta
 
@@ -47,6 +48,29 @@ def apply(usage_statement, output_path, write_mode):
     
     with open(output_path, write_mode) as f:
         f.write(ret["jwt"] + "," + ret["cert"].replace("\n", "\\n")[:-2] + "\n")
+
+def apply_batch(usage_statements, output_path, write_mode):
+
+    client_cert = "./cache/consumer.crt"
+    client_key  = "./cache/consumer.key"
+    ca_cert     = "./cache/RootCA.pem"
+
+    # all declarations in one batch must be addressed to the same provider
+    provider_addr = usage_statements[0]["data_ID"].split("//")[1].split("/")[0]
+    ret = json.loads(requests.post("https://" + provider_addr + "/apply/batch", verify=ca_cert, cert=(client_cert, client_key), json={"declarations": usage_statements}).text)
+
+    # tokens are matched to arguments by their position, so one failed item invalidates the whole batch
+    if (ret["status"] != "completed"):
+        print(ret.get("description", f"Failed to apply ({ret['status']})"))
+        for data_id, result in zip([d["data_ID"] for d in usage_statements], ret.get("results", [])):
+            if (result["status"] == "failed"):
+                print(f"  {data_id}: {result['description']}")
+        sys.exit(1)
+    
+    cert = ret["cert"].replace("\n", "\\n")[:-2]
+    with open(output_path, write_mode) as f:
+        for result in ret["results"]:
+            f.write(result["jwt"] + "," + cert + "\n")
     
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -57,6 +81,7 @@ if __name__ == "__main__":
     parser.add_argument("-exd", "--expiration_date", default=get_expiration(30))
     parser.add_argument("-o", "--output-path", default="cache/tokens")
     parser.add_argument("-a", "--append-token", action="store_true")
+    parser.add_argument("-b", "--batch", action="store_true", help="data_id and arg_index are comma-separated lists applied for in one request")
 
     parser.add_argument("subject")
     parser.add_argument("app_id")
@@ -66,11 +91,16 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
     
-    usage_statement = create_declaration(args.subject, args.app_id, args.data_id, args.arg_index, args.key, args.counter, args.location, args.duration, args.expiration_date)
-
     write_mode = "w"
     if args.append_token:
         write_mode = "a"
 
-    apply(usage_statement, args.output_path, write_mode)
+    if args.batch:
+        usage_statements = []
+        for data_id, arg_index in zip(args.data_id.split(","), args.arg_index.split(",")):
+            usage_statements.append(create_declaration(args.subject, args.app_id, data_id, arg_index, args.key, args.counter, args.location, args.duration, args.expiration_date))
+        apply_batch(usage_statements, args.output_path, write_mode)
+    else:
+        usage_statement = create_declaration(args.subject, args.app_id, args.data_id, args.arg_index, args.key, args.counter, args.location, args.duration, args.expiration_date)
+        apply(usage_statement, args.output_path, write_mode)
 
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from create_declaration import create_declaration, get_expiration
+
+# ===== TLS settings and constants =====
+
+CLIENT_CERT = "./cache/consumer.crt"
+CLIENT_KEY  = "./cache/consumer.key"
+CA_CERT     = "./cache/RootCA.pem"
+
+# =====================================
+
+def percentile(sorted_values, p):
+    """Return the p-th percentile (0-100) of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+def run_load(url: str, total: int, concurrency: int, new_connection: bool, cert: tuple, bodies: list = None):
+    """
+    Send `total` requests to `url` from `concurrency` threads.
+    - new_connection: open a fresh TLS connection per request (measures handshake cost);
+      otherwise each thread keeps one keep-alive session.
+    - cert: (certificate, key) presented as the client certificate.
+    - bodies: JSON bodies POSTed one per request (e.g. declarations for /apply); GET requests if None.
+    Returns (latencies_ms, errors, elapsed_sec).
+    """
+    local = threading.local()
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def _get_session():
+        if new_connection:
+            return requests.Session()
+        session = getattr(local, "session", None)
+        if session is None:
+            session = requests.Session()
+            local.session = session
+        return session
+
+    def _one(i):
+        session = _get_session()
+        start = time.perf_counter()
+        try:
+            if bodies is None:
+                res = session.get(url, verify=CA_CERT, cert=cert, timeout=30)
+            else:
+                res = session.post(url, json=bodies[i], verify=CA_CERT, cert=cert, timeout=30)
+            # read the whole body so that streamed responses (/data) are timed to the end
+            res.content
+            ok = res.status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if new_connection:
+            session.close()
+        with lock:
+            if ok:
+                latencies.append(elapsed_ms)
+            else:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(_one, range(total)))
+    elapsed_sec = time.perf_counter() - start
+
+    return sorted(latencies), errors[0], elapsed_sec
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Closed-loop HTTPS load generator for the data providing server."
+    )
+    parser.add_argument("-n", "--requests", type=int, default=1000, help="Total number of requests.")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Number of concurrent clients.")
+    parser.add_argument("--new-connection", action="store_true", help="Open a new TLS connection for every request.")
+    parser.add_argument("--label", default="provider", help="Label written to the ___BENCH___ line (e.g. server mode).")
+    parser.add_argument("--cert", default=CLIENT_CERT, help="Client certificate (an attested enclave certificate for /data).")
+    parser.add_argument("--key", default=CLIENT_KEY, help="Private key of the client certificate.")
+    parser.add_argument("--apply", metavar="APP_ID", help="POST a distinct signed declaration for APP_ID per request (url is the /apply endpoint).")
+    parser.add_argument("--data-id", default="https://provider01.vddpi:443/data/svm/load-{}",
+                        help="Data ID of the i-th declaration ({} is replaced by i); each needs a providing policy for APP_ID.")
+    parser.add_argument("--subject", default="consumer.example.com", help="Consumer named in the declarations.")
+    parser.add_argument("--declaration-key", default=CLIENT_KEY, help="Key signing the declarations.")
+    parser.add_argument("url", help="Target URL (e.g. https://provider01.vddpi:443/apply or https://provider01.vddpi:443/data/svm/1k).")
+
+    args = parser.parse_args()
+
+    bodies = None
+    if args.apply:
+        # sign before the run; a declaration can be applied for once, so every request gets its own data ID
+        expiration_date = get_expiration(30)
+        bodies = [create_declaration(args.subject, args.apply, args.data_id.format(i), "1", args.declaration_key, "5", "JP", "30", expiration_date)
+                  for i in range(args.requests)]
+
+    start = datetime.now()
+    latencies, errors, elapsed_sec = run_load(args.url, args.requests, args.concurrency, args.new_connection, (args.cert, args.key), bodies)
+    end = datetime.now()
+
+    rps = len(latencies) / elapsed_sec if elapsed_sec > 0 else 0.0
+    print(
+        f"___BENCH___ Provider load (Start:{start.strftime('%Y-%m-%d %H:%M:%S')}, End:{end.strftime('%Y-%m-%d %H:%M:%S')}, "
+        f"Duration_ms:{round(elapsed_sec * 1000)}, label:{args.label}, concurrency:{args.concurrency}, "
+        f"new_connection:{args.new_connection}, requests:{args.requests}, errors:{errors}, rps:{rps:.1f}, "
+        f"p50_ms:{percentile(latencies, 50):.1f}, p90_ms:{percentile(latencies, 90):.1f}, p99_ms:{percentile(latencies, 99):.1f})"
+    )
+
+if __name__ == "__main__":
+    main()
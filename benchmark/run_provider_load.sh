@@ -0,0 +1,109 @@
+#!/bin/bash
+
+########################################
+# Configuration
+########################################
+REQUESTS=${REQUESTS:-2000}
+CONCURRENCY_LIST=${CONCURRENCY_LIST:-"1 8 32"}
+SLEEP_TIME=10
+VDDPI_DIR=$HOME/VDDPI
+VDDPI_BENCH_DIR=$HOME/VDDPI/benchmark
+PROVIDER_URL="https://provider01.vddpi:443"
+# data IDs only used for /apply load (no data file is needed to apply)
+LOAD_DATA_ID="$PROVIDER_URL/data/svm/load-"
+# data delivered by the /data load
+DATA_ID=${DATA_ID:-"$PROVIDER_URL/data/svm/1k"}
+# certificate of a consumer enclave running app_id (the /data load is skipped without it)
+ENCLAVE_CERT=${ENCLAVE_CERT:-cache/enclave.crt}
+ENCLAVE_KEY=${ENCLAVE_KEY:-cache/enclave.key}
+LOGFILE=$VDDPI_BENCH_DIR/cache/eval_provider_load.log
+
+########################################
+# Arguments
+########################################
+app_id="$1"
+provider_db_config="$2"
+
+########################################
+# Functions
+########################################
+function run_sql() {
+    mysql --defaults-file=$provider_db_config provider -e "$1"
+}
+
+function insert_policies() {
+    local expiration_date=$(date -d "+90 days" +"%Y-%m-%d")
+    local values="('provider.example.com','svm','$DATA_ID','consumer.example.com','$app_id','svm.data',100,'JP',90,'$expiration_date')"
+    for i in $(seq 0 $((REQUESTS - 1))); do
+        values+=",('provider.example.com','svm','$LOAD_DATA_ID$i','consumer.example.com','$app_id','svm.data',100,'JP',90,'$expiration_date')"
+    done
+    run_sql "REPLACE INTO policy (data_provider, data_type, data_id, data_consumer, data_processing, data_disclosing, data_counter, data_location, data_duration, data_expiration_date) VALUES $values"
+}
+
+function clear_load_declarations() {
+    run_sql "DELETE FROM saved_policy WHERE data_id LIKE '$LOAD_DATA_ID%'"
+}
+
+########################################
+# Main
+########################################
+if [ -z "$app_id" ] || [ -z "$provider_db_config" ]; then
+    echo "Usage: $0 <app_id> <provider_db_config>"
+    exit 1
+fi
+
+pushd $VDDPI_BENCH_DIR > /dev/null
+
+echo "Get root CA certificate"
+curl registry01.vddpi:8001/root-crt > cache/RootCA.pem
+
+if [ ! -f cache/consumer.crt ]; then
+    echo "Get consumer certificate"
+    echo -e "JP\n\n\n\n\nconsumer.example.com\n\n\n\n" | python3 get_cert.py registry01.vddpi:8001 cache
+fi
+
+# Clear file
+> $LOGFILE
+
+for mode in development production; do
+    echo "Restart containers on provider01.vddpi (mode:$mode)"
+    ssh provider01.vddpi "cd $VDDPI_DIR && \
+        make stop-provider > /dev/null 2>&1; \
+        make run-provider SERVER_PROVIDER_MODE=$mode"
+    sleep $SLEEP_TIME
+
+    until mysqladmin --defaults-file=$provider_db_config ping --silent
+    do
+        echo "MySQL is not ready..."
+        sleep 2
+    done
+
+    echo "Preparing data provision policies (app_id:$app_id, requests:$REQUESTS)"
+    insert_policies
+
+    if [ -f $ENCLAVE_CERT ]; then
+        echo "Applying for data usage (app_id:$app_id, data_id:$DATA_ID)"
+        python3 create_declaration.py -o cache/token-load consumer.example.com "$app_id" "$DATA_ID" 1 cache/consumer.key
+    fi
+
+    for concurrency in $CONCURRENCY_LIST; do
+        for new_connection in "" "--new-connection"; do
+            echo "Run /apply load (mode:$mode, concurrency:$concurrency, options:$new_connection)"
+            clear_load_declarations
+            python3 provider_load.py -n $REQUESTS -c $concurrency $new_connection --label $mode/apply \
+                --apply "$app_id" --data-id "$LOAD_DATA_ID{}" "$PROVIDER_URL/apply" | tee -a $LOGFILE
+
+            if [ -f $ENCLAVE_CERT ]; then
+                echo "Run /data load (mode:$mode, concurrency:$concurrency, options:$new_connection)"
+                python3 provider_load.py -n $REQUESTS -c $concurrency $new_connection --label $mode/data \
+                    --cert $ENCLAVE_CERT --key $ENCLAVE_KEY "$DATA_ID" | tee -a $LOGFILE
+            else
+                echo "Skip /data load (no enclave certificate at $ENCLAVE_CERT)"
+            fi
+        done
+    done
+done
+
+echo "Benchmark finished (result:$LOGFILE)"
+
+popd > /dev/null
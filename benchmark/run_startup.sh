@@ -0,0 +1,97 @@
+#!/bin/bash
+
+# Compare the startup of the consumer enclave between startup profiles
+# (default: whole arch libdirs trusted, optimized: traced trusted-files list).
+# Each trial restarts the consumer and records enclave init, interpreter init (until sessions are
+# accepted), the warm-up (deferred imports, which overlap with the first session) and the first request.
+#
+# The optimized profile has its own MRENCLAVE, so tokens must be issued for each profile:
+# $CACHE_DIR/<profile>/ holds RootCA.pem, consumer.crt, consumer.key and the token-* files
+# obtained with phase1/phase2 of run_eval_01.sh against the image built with that profile.
+
+########################################
+# Configuration
+########################################
+TRIALS=${TRIALS:-5}
+STARTUP_PROFILES=${STARTUP_PROFILES:-"default optimized"}
+MODE=${MODE:-eval-01}
+STARTUP_TIMEOUT=${STARTUP_TIMEOUT:-300}
+VDDPI_DIR=$HOME/VDDPI
+VDDPI_BENCH_DIR=$HOME/VDDPI/benchmark
+CACHE_DIR=${CACHE_DIR:-$VDDPI_BENCH_DIR/cache/startup}
+CONSUMER_LOG=$VDDPI_DIR/consumer/logs/app.log
+LOGFILE=$VDDPI_BENCH_DIR/cache/eval_startup.log
+
+########################################
+# Functions
+########################################
+wait_ready() {
+    local elapsed=0
+    until grep -q "___BENCH___ Enclave startup" "$CONSUMER_LOG" 2>/dev/null; do
+        if [ $elapsed -ge $STARTUP_TIMEOUT ]; then
+            echo "Error: consumer did not start within $STARTUP_TIMEOUT seconds"
+            return 1
+        fi
+        sleep 1
+        elapsed=$((elapsed + 1))
+    done
+}
+
+########################################
+# Main
+########################################
+pushd $VDDPI_BENCH_DIR > /dev/null
+
+# Clear file
+> $LOGFILE
+
+for profile in $STARTUP_PROFILES; do
+    echo "Build gramine-consumer (mode:$MODE, startup profile:$profile)"
+    (
+        cd $VDDPI_DIR
+        make stop-consumer > /dev/null 2>&1
+        MODE=$MODE STARTUP_PROFILE=$profile make gramine-consumer
+    )
+    # certificates are sealed to the MRENCLAVE of the previous profile
+    rm -f $VDDPI_DIR/consumer/certs/*
+
+    token=$(ls $CACHE_DIR/$profile/token-* 2>/dev/null | head -n 1)
+    if [ -z "$token" ]; then
+        echo "No token in $CACHE_DIR/$profile, the first request is not measured"
+    fi
+
+    for trial in $(seq 1 $TRIALS); do
+        echo "Restart consumer (profile:$profile, trial:$trial)"
+        (
+            cd $VDDPI_DIR
+            make stop-consumer > /dev/null 2>&1
+            rm -f consumer/logs/*
+            MODE=$MODE make run-consumer
+        )
+        wait_ready || exit 1
+
+        if [ -n "$token" ]; then
+            python3 client.py gencert "$CACHE_DIR/$profile" "consumer01.vddpi" 8001 > /dev/null
+
+            start_ts=$(date +"%Y-%m-%d %H:%M:%S")
+            start_epoch=$(date +%s%3N)
+            python3 client.py process "$token" "$CACHE_DIR/$profile" "consumer01.vddpi" 8002 > /dev/null
+            end_ts=$(date +"%Y-%m-%d %H:%M:%S")
+            end_epoch=$(date +%s%3N)
+            echo "___BENCH___ First request client (Start:$start_ts, End:$end_ts, Duration_ms:$((end_epoch - start_epoch)), profile:$profile, trial:$trial)" | tee -a $LOGFILE
+            # the enclave reports the first request after the result has been sent
+            sleep 1
+        fi
+
+        grep "___BENCH___" "$CONSUMER_LOG" | sed "s/^\[[^]]*\] //; s/)$/, profile:$profile, trial:$trial)/" | tee -a $LOGFILE
+    done
+done
+
+(
+    cd $VDDPI_DIR
+    make stop-consumer > /dev/null 2>&1
+)
+
+echo "Benchmark finished (result:$LOGFILE)"
+
+popd > /dev/null
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import argparse
+import importlib
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+def import_plib(lib_path: str):
+    """Import plib.py from lib_path."""
+    sys.path.insert(0, str(Path(lib_path).resolve()))
+    return importlib.import_module("plib")
+
+def same_problem(expected, actual):
+    """Compare a (y, x) result of the list-of-dicts form with a (y, csr_matrix) result."""
+    rows = [{i: v for i, v in sorted(xi.items()) if v != 0} for xi in expected[1]]
+    csr = actual[1]
+    return expected[0] == actual[0].tolist() and rows == [
+        dict(zip((csr.indices[csr.indptr[i]:csr.indptr[i + 1]] + 1).tolist(), csr.data[csr.indptr[i]:csr.indptr[i + 1]].tolist()))
+        for i in range(csr.shape[0])
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the line-by-line LIBSVM parser of plib (list of dicts) with the NumPy bulk parser (CSR matrix) used by run_svm."
+    )
+    parser.add_argument("lib_path", help="Directory containing plib.py (e.g. docker/gramine_consumer/code_eval_02).")
+    parser.add_argument("data_files", nargs="+", help="SVM data JSON files (e.g. docker/provider/svm_data/10k.json).")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of measurements per mode.")
+    parser.add_argument("--parse-only", action="store_true", help="Do not build the libsvm problem (svm_problem) from the parsed data.")
+
+    args = parser.parse_args()
+
+    plib = import_plib(args.lib_path)
+    modes = {
+        "lines": lambda data: plib.svm_read_problem_from_lines(data),
+        "bulk_csr": lambda data: plib.svm_read_problem_from_data(data, return_scipy=True),
+    }
+    with_problem = not args.parse_only
+    if with_problem:
+        from libsvm.svm import svm_problem
+
+    for data_file in args.data_files:
+        with open(data_file, "r") as f:
+            data = json.load(f)["data"].replace('\\n', '\n')
+
+        if not same_problem(plib.svm_read_problem_from_lines(data), plib.svm_read_problem_from_data(data, return_scipy=True)):
+            print(f"{Path(data_file).name}: bulk parser result differs from the line-by-line parser")
+            sys.exit(1)
+
+        best = {}
+        for mode, run in modes.items():
+            for _ in range(args.repeat):
+                start = datetime.now()
+                perf_start = time.perf_counter()
+                y, x = run(data)
+                if with_problem:
+                    svm_problem(y, x)
+                elapsed_ms = (time.perf_counter() - perf_start) * 1000
+                end = datetime.now()
+                best[mode] = min(best.get(mode, elapsed_ms), elapsed_ms)
+                print(
+                    f"___BENCH___ SVM parsing (Start:{start.strftime('%Y-%m-%d %H:%M:%S')}, End:{end.strftime('%Y-%m-%d %H:%M:%S')}, "
+                    f"Duration_ms:{elapsed_ms:.3f}, file:{Path(data_file).name}, mode:{mode}, with_problem:{with_problem})"
+                )
+
+        print(f"{Path(data_file).name}: bulk_csr {best['lines'] / best['bulk_csr']:.2f}x faster than lines (best of {args.repeat}, with_problem:{with_problem})")
+
+if __name__ == "__main__":
+    main()
@@ -132,8 +132,8 @@ def analyzer(source_code):
     
     return 0, DataProcessingSpec(input_list, func, result_sink)
 
-PROCESS_LINE_NUM = 24
-END_LINE_NUM = 280
+PROCESS_LINE_NUM = 80
+END_LINE_NUM = 862
 
 def check_format(source_code):
     
@@ -3,7 +3,7 @@ use provider;
 create table policy (
     data_provider varchar(64) not null,
     data_type varchar(64) not null,
-    data_id varchar(64),
+    data_id varchar(2048) not null,
     data_consumer varchar(64) not null,
     data_processing varchar(128) not null,
     data_disclosing varchar(64) not null,
@@ -11,16 +11,19 @@ create table policy (
     data_location varchar(10) null,
     data_duration int null,
     data_expiration_date varchar(11) null,
-    PRIMARY KEY(data_processing, data_id)
+    data_id_hash binary(32) as (unhex(sha2(data_id, 256))) stored not null,
+    PRIMARY KEY(data_processing, data_id_hash),
+    INDEX idx_policy_data_id(data_id_hash)
 );
 
 create table saved_policy (
     consumer_subject varchar(64) not null,
     app_id varchar(64) not null,
-    data_id varchar(64) not null,
+    data_id varchar(2048) not null,
     data_counter varchar(64) null,
     data_location varchar(10) null,
     data_duration int null,
     data_expiration_date varchar(11) null,
-    PRIMARY KEY(app_id, data_id)
+    data_id_hash binary(32) as (unhex(sha2(data_id, 256))) stored not null,
+    PRIMARY KEY(app_id, data_id_hash)
 );
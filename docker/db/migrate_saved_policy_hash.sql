@@ -0,0 +1,18 @@
+-- Migrate a provider database created with the previous 01_create_db.sql.
+-- policy and saved_policy are keyed by the SHA-256 of data_id so that full data URLs fit
+-- and lookups by data_id stay on an index of fixed width.
+--   mysql --defaults-file=<config> provider < migrate_saved_policy_hash.sql
+use provider;
+
+alter table saved_policy
+    modify data_id varchar(2048) not null,
+    add column data_id_hash binary(32) as (unhex(sha2(data_id, 256))) stored not null,
+    drop primary key,
+    add primary key(app_id, data_id_hash);
+
+alter table policy
+    modify data_id varchar(2048) not null,
+    add column data_id_hash binary(32) as (unhex(sha2(data_id, 256))) stored not null,
+    drop primary key,
+    add primary key(data_processing, data_id_hash),
+    add index idx_policy_data_id(data_id_hash);
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Print the shared libraries the consumer app actually loads, one manifest path per line.
+
+The app (main.py and the modules it imports lazily) is imported outside the enclave and
+/proc/self/maps is read afterwards; every entry of the library directories that resolves to a
+mapped file is printed, so sonames and their symlink targets are both listed.
+
+Usage: trace_trusted_files.py [code dir] [arch libdir]
+"""
+import ast
+import importlib
+import os
+import socket
+import sys
+import threading
+
+def nested_imports(code_dir: str):
+    """Yield module names imported inside functions of the .py files in code_dir."""
+    for name in sorted(os.listdir(code_dir)):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(code_dir, name), "r") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    yield alias.name
+            elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+                yield node.module
+
+def exercise_runtime():
+    """Load the libraries glibc only opens on demand (NSS resolvers, libgcc_s for thread exit)."""
+    for host in ["localhost", "registry01.vddpi"]:
+        try:
+            socket.getaddrinfo(host, 443)
+        except OSError:
+            pass
+    thread = threading.Thread(target=lambda: None)
+    thread.start()
+    thread.join()
+
+def mapped_files():
+    """Return the real paths of all files mapped into this process."""
+    paths = set()
+    with open("/proc/self/maps", "r") as f:
+        for line in f:
+            fields = line.split(None, 5)
+            if len(fields) == 6 and fields[5].startswith("/"):
+                paths.add(os.path.realpath(fields[5].strip()))
+    return paths
+
+def main():
+    code_dir = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else "./code")
+    arch_libdir = sys.argv[2] if len(sys.argv) > 2 else "/lib/x86_64-linux-gnu"
+
+    sys.path.insert(0, code_dir)
+    app = importlib.import_module("main")
+    app.import_deferred_modules()
+    for module in nested_imports(code_dir):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    exercise_runtime()
+
+    mapped = mapped_files()
+    for lib_dir in [arch_libdir, "/usr" + arch_libdir]:
+        if not os.path.isdir(lib_dir):
+            continue
+        for name in sorted(os.listdir(lib_dir)):
+            path = os.path.join(lib_dir, name)
+            if os.path.isfile(path) and os.path.realpath(path) in mapped:
+                print(path)
+
+if __name__ == "__main__":
+    main()
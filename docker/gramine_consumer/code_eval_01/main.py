@@ -1,24 +1,83 @@
-import requests
+import time
+# taken before the other imports so the interpreter-init time includes them
+STARTED_AT = time.time()
 import json
-import urllib3
 import os
-import jwt
 import copy
 import ast
+import base64
+import hashlib
 import socket
 import ssl
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import padding
-from datetime import datetime
+import errno
+import struct
+import zlib
+import threading
+import argparse
+import importlib
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from datetime import datetime, timedelta
 import plib
+
+class LazyModule:
+    # module imported on first attribute access; keeps requests, jwt and cryptography
+    # off the enclave's startup path (see import_deferred_modules)
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if (self.module is None):
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attr)
+
+requests = LazyModule("requests")
+urllib3 = LazyModule("urllib3")
+jwt = LazyModule("jwt")
+x509 = LazyModule("cryptography.x509")
+backends = LazyModule("cryptography.hazmat.backends")
+serialization = LazyModule("cryptography.hazmat.primitives.serialization")
+padding = LazyModule("cryptography.hazmat.primitives.asymmetric.padding")
 CA_CERT = "./code/RootCA.pem"
 TRUSTED_CA_CERT = "./certs/RootCA.pem"
 SKEY = "./certs/private.key"
 CONSUMER_CERT = "./certs/client.pem"
 DUMMY_CERT = "./code/dummy.pem"
 DUMMY_KEY = "./code/dummy.key"
+SESSION_WORKERS = 4
+LISTEN_BACKLOG = 16
+PORT_RETRY_INTERVAL = 0.1
+ENCLAVE_ID = "0"
+# imported in the background while the enclave already accepts sessions (app libraries such as
+# libsvm and scipy are imported by plib on first use)
+DEFERRED_MODULES = ["requests", "requests.adapters", "urllib3", "jwt", "cryptography.x509", "cryptography.hazmat.backends",
+                    "cryptography.hazmat.primitives.serialization", "cryptography.hazmat.primitives.asymmetric.padding"]
+ACQUISITION_WORKERS = 4
+TRUSTED_TIME_MAX_AGE = 60
+LOCATION_CACHE_TTL = 300
+PROVIDER_CERT_CACHE_SIZE = 64
+TOKEN_CACHE_SIZE = 1024
+DATA_CACHE_MAX_BYTES = 128 * 1024 * 1024
+# "copy": process_data gets deep copies (dict, list). "view": it gets ReadOnlyMapping/ReadOnlySequence
+# views over the cached payload, which copy nothing but are not dict/list instances (json.dumps,
+# list + list and isinstance checks fail on them; copy.deepcopy(view) returns plain dicts and lists)
+ARGUMENT_MODE = "copy"
+USAGE_JOURNAL = "./data/usage.journal"
+USAGE_JOURNAL_COMPACT_MIN = 1024
+# framed protocol on the session port: the request is one frame (FRAME_HEADER + token payload),
+# the response is a stream of RESPONSE_FRAME messages closed by a frame with FRAME_END
+FRAME_MAGIC = b"VDDP"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("!4sBBQ")
+RESPONSE_FRAME = struct.Struct("!BBI")
+FRAME_COMPRESSED = 0x01
+FRAME_END = 0x02
+FRAME_MAX_PAYLOAD = 64 * 1024 * 1024
+FRAME_COMPRESS_MIN = 256
 
 ##############################################
 ######The following codes can be changed.#####
@@ -86,8 +145,7 @@ def data_acquisition(data_id, client_cn):
         return False, ""
     
     # cache data
-    cache_data(received_data, received_data["path"])
-    return True, received_data
+    return True, cache_data(received_data, received_data["path"])
 
 def check_condition_phase(usage_condition):
     if(not check_expiration_date(usage_condition)):
@@ -98,8 +156,7 @@ def check_condition_phase(usage_condition):
     
     return True, 0
 
-def check_expiration_date(condition):
-    API_CA_CERT = """-----BEGIN CERTIFICATE-----
+API_CA_CERT = """-----BEGIN CERTIFICATE-----
 MIIDSzCCAjMCFDd4rPNHr1Devfmp0NLzGcr+6ggnMA0GCSqGSIb3DQEBCwUAMGIx
 CzAJBgNVBAYTAkpQMRMwEQYDVQQIDApTb21lLVN0YXRlMSEwHwYDVQQKDBhJbnRl
 cm5ldCBXaWRnaXRzIFB0eSBMdGQxGzAZBgNVBAMMEnJvb3RjYS5leGFtcGxlLmNv
@@ -120,16 +177,112 @@ RpW24O8MGN5wyHW/5P+FZ3UcQ78wS+s4girINinciiIqPayAWJsSLgfOKW8ogZ8P
 krEL2VWGrv3IkBKvGUaSVu4rbwxqealC6vid1yi0TA==
 -----END CERTIFICATE-----
 """
-    CERT_PATH = "./certs/api_ca_cert.pem"
-    TRUSTED_TIME_API_URL = "http://registry01.vddpi:8005/time"
+TRUSTED_TIME_API_URL = "http://registry01.vddpi:8005/time"
+TRUSTED_GEOLOCATION_API_URL = "http://registry01.vddpi:8005/location"
+
+HANDSHAKE_SCOPE = threading.local()
+def count_handshake(resumed):
+    # handshakes are charged to the consumer session the current thread works for
+    session = getattr(HANDSHAKE_SCOPE, "session", None)
+    if (session is not None):
+        session.count_handshake(resumed)
+
+class PooledSSLContext(ssl.SSLContext):
+    # client context that offers the last TLS session of a host again so that reconnects resume with a ticket
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        self = super().__new__(cls, protocol)
+        self.tls_sessions = {}
+        self.tls_sessions_lock = threading.Lock()
+        return self
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True, suppress_ragged_eofs=True, server_hostname=None, session=None):
+        if (session is None and not server_side):
+            with self.tls_sessions_lock:
+                session = self.tls_sessions.get(server_hostname)
+        tls_socket = super().wrap_socket(sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect, suppress_ragged_eofs=suppress_ragged_eofs, server_hostname=server_hostname, session=session)
+        if (do_handshake_on_connect and not server_side):
+            if (tls_socket.session is not None):
+                with self.tls_sessions_lock:
+                    self.tls_sessions[server_hostname] = tls_socket.session
+            count_handshake(tls_socket.session_reused)
+        return tls_socket
+
+def ssl_context_adapter(ssl_context):
+    # HTTPS adapter using a prebuilt SSL context instead of reading PEM files on every request;
+    # built per instance so requests.adapters is not needed to define a subclass at import time
+    adapter = requests.adapters.HTTPAdapter()
+    adapter.init_poolmanager(adapter._pool_connections, adapter._pool_maxsize, block=adapter._pool_block, ssl_context=ssl_context)
+    adapter.cert_verify = verify_with_context
+    return adapter
+
+def verify_with_context(conn, url, verify, cert):
+    # trust anchors and client certificate are already loaded into the context
+    conn.cert_reqs = "CERT_REQUIRED"
+    conn.ca_certs = None
+    conn.ca_cert_dir = None
+
+class HostSessions:
+    # keep-alive sessions per host sharing one prebuilt SSL context;
+    # requests.Session is not thread-safe, so each thread gets its own set
+    def __init__(self, ssl_context=None):
+        self.ssl_context = ssl_context
+        self.local = threading.local()
+
+    def get(self, url):
+        if (not hasattr(self.local, "sessions")):
+            self.local.sessions = {}
+        host = urlparse(url).netloc
+        if (host not in self.local.sessions):
+            session = requests.Session()
+            session.mount("https://", ssl_context_adapter(self.ssl_context))
+            self.local.sessions[host] = session
+        return self.local.sessions[host]
+
+API_SSL_CONTEXT = PooledSSLContext()
+API_SSL_CONTEXT.load_verify_locations(cadata=API_CA_CERT)
+api_sessions = HostSessions(API_SSL_CONTEXT)
+
+class TrustedClock:
+    # trusted time extrapolated with the monotonic clock; refetched once the reading is older than max_age seconds
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.trusted_time = None
+        self.fetched_at = 0.0
+
+    def now(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.fetched_at
+            if (self.trusted_time is None or elapsed < 0 or elapsed > self.max_age):
+                res_time = json.loads(api_sessions.get(TRUSTED_TIME_API_URL).get(TRUSTED_TIME_API_URL).text)["datetime"]
+                self.trusted_time = datetime.strptime(res_time[:19], "%Y-%m-%dT%H:%M:%S")
+                self.fetched_at = time.monotonic()
+                elapsed = 0.0
+            return self.trusted_time + timedelta(seconds=elapsed)
+
+class LocationCache:
+    # geolocation of this host, cached for ttl seconds
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.loc_info = None
+        self.fetched_at = 0.0
+
+    def country_code(self):
+        with self.lock:
+            if (self.loc_info is None or time.monotonic() - self.fetched_at > self.ttl):
+                self.loc_info = json.loads(api_sessions.get(TRUSTED_GEOLOCATION_API_URL).post(TRUSTED_GEOLOCATION_API_URL, json={"address": "dummy_ipAddr"}).text)
+                self.fetched_at = time.monotonic()
+            return self.loc_info["countryCode"]
+
+trusted_clock = TrustedClock(TRUSTED_TIME_MAX_AGE)
+location_cache = LocationCache(LOCATION_CACHE_TTL)
+
+def check_expiration_date(condition):
     expiration_date_cond = condition["expirationDate"]
     if (expiration_date_cond == ""):
         return True, 1
-    with open(CERT_PATH, "w") as f:
-        f.write(API_CA_CERT)
-    res_time = json.loads(requests.get(TRUSTED_TIME_API_URL, verify=CERT_PATH).text)["datetime"]
-    os.remove(CERT_PATH)
-    now = datetime.strptime(res_time[:19], "%Y-%m-%dT%H:%M:%S")
+    now = trusted_clock.now()
     datetime_expiration_date_cond = datetime.strptime(expiration_date_cond, "%Y-%m-%d")
     if (now <= datetime_expiration_date_cond):
         return True, 1
@@ -137,37 +290,10 @@ krEL2VWGrv3IkBKvGUaSVu4rbwxqealC6vid1yi0TA==
         return False, 0
 
 def check_location(condition):
-    API_CA_CERT = """-----BEGIN CERTIFICATE-----
-MIIDSzCCAjMCFDd4rPNHr1Devfmp0NLzGcr+6ggnMA0GCSqGSIb3DQEBCwUAMGIx
-CzAJBgNVBAYTAkpQMRMwEQYDVQQIDApTb21lLVN0YXRlMSEwHwYDVQQKDBhJbnRl
-cm5ldCBXaWRnaXRzIFB0eSBMdGQxGzAZBgNVBAMMEnJvb3RjYS5leGFtcGxlLmNv
-bTAeFw0yNDA5MjcxMDE0MjBaFw0zNDA5MjUxMDE0MjBaMGIxCzAJBgNVBAYTAkpQ
-MRMwEQYDVQQIDApTb21lLVN0YXRlMSEwHwYDVQQKDBhJbnRlcm5ldCBXaWRnaXRz
-IFB0eSBMdGQxGzAZBgNVBAMMEnJvb3RjYS5leGFtcGxlLmNvbTCCASIwDQYJKoZI
-hvcNAQEBBQADggEPADCCAQoCggEBAM4/mSYFhpuHrREzpC64/RbICurPBeWsl7/T
-2w21hXtS5z0FjD+sLaPAgr3C1mZkuh5GO/WzqIz9SNa9xMVMEMg+k7K6wIozgZzp
-YPQVNBky1TvXQpm20rH+l0vms17ULXbuX26hqQJADARrUOSXdF+wsa8/CHHWqtWa
-e06eoN79pqLZmTlRttCUBBMyWYXgEZy1iJczOgsi6u5iLlWj4zvmzUKcQev8BZV1
-WC1DhmUgksfclgXLaVemyn35WRgUwsULMR5lB/URPcAjLRIf3n4eHie8mmMKLEez
-9eOtvJImuwIWGNyT5cPv+jo9fY6y9lBt+Y6gXStFA5MPjAflIUkCAwEAATANBgkq
-hkiG9w0BAQsFAAOCAQEArV2X1bcTzSFY3AtdtkDuUeJGwWlV6lfzyMm9lzS3WJJ3
-rDOvQ8Q+G1ilJr4TC+xMIPcHS/XsUxmqPDlguPx9GaWxL/6MNczFsXhTllwBorZF
-RHBhv8uT6LgV03xVq/XM+t4RT8SlTYmfz8xjKshFR4jdqz2QFJ6GrH2Xdny0hN3V
-nwC3fcDP9wwIKMS5Jl8q9b0y7+uzjtB5qe3kW6cFNlJqDyP0cofH0cqGiRBDBZZC
-RpW24O8MGN5wyHW/5P+FZ3UcQ78wS+s4girINinciiIqPayAWJsSLgfOKW8ogZ8P
-krEL2VWGrv3IkBKvGUaSVu4rbwxqealC6vid1yi0TA==
------END CERTIFICATE-----
-"""
-    CERT_PATH = "./certs/api_ca_cert.pem"
-    TRUSTED_GEOLOCATION_API_URL = "http://registry01.vddpi:8005/location"
     location_cond = condition["location"]
     if (location_cond == ""):
         return True, 1
-    with open(CERT_PATH, "w") as f:
-        f.write(API_CA_CERT)
-    loc_info = json.loads(requests.post(TRUSTED_GEOLOCATION_API_URL, verify=CERT_PATH, json={"address": "dummy_ipAddr"}).text)
-    os.remove(CERT_PATH)
-    if (loc_info["countryCode"] == location_cond):
+    if (location_cache.country_code() == location_cond):
         return True, 1
     else:
         return False, 1
@@ -185,96 +311,403 @@ def data_saving(data):
         store_data(data)
         return False
 
-def verify_token(token, cert):
-    # Verify Cert
+class LRUCache:
+    # thread-safe mapping that drops the least recently used entry beyond maxsize
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if (key not in self.entries):
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while (len(self.entries) > self.maxsize):
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            return self.entries.pop(key, None)
+
+ROOT_CA_CERT = None
+CONSUMER_CN = None
+# set at startup: done once the deferred imports and load_verification_material have run
+VERIFICATION_READY = None
+def load_verification_material():
+    # parsed once at startup instead of on every token
+    global ROOT_CA_CERT, CONSUMER_CN
     with open(TRUSTED_CA_CERT, "rb") as f:
-        root_ca_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
-    cert = x509.load_pem_x509_certificate(cert.replace("\\n", "\n").encode(), default_backend())
-    
-    root_ca_cert.public_key().verify(
+        ROOT_CA_CERT = x509.load_pem_x509_certificate(f.read(), backends.default_backend())
+    with open(CONSUMER_CERT, "rb") as f:
+        client_cert = x509.load_pem_x509_certificate(f.read(), backends.default_backend())
+    CONSUMER_CN = client_cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value
+
+provider_certs = LRUCache(PROVIDER_CERT_CACHE_SIZE)
+def verify_provider_cert(cert_pem):
+    # returns (public key PEM, MRENCLAVE or None) of a provider certificate issued by the root CA
+    fingerprint = hashlib.sha256(cert_pem.encode()).hexdigest()
+    verified = provider_certs.get(fingerprint)
+    if (verified is not None):
+        return verified
+
+    cert = x509.load_pem_x509_certificate(cert_pem.replace("\\n", "\n").encode(), backends.default_backend())
+    ROOT_CA_CERT.public_key().verify(
         cert.signature,
         cert.tbs_certificate_bytes,
         padding.PKCS1v15(),
         cert.signature_hash_algorithm,
     )
-    
-    # Verify JWT
+
     public_key_pem = cert.public_key().public_bytes(
         encoding=serialization.Encoding.PEM,
         format=serialization.PublicFormat.SubjectPublicKeyInfo
-    )
+    ).decode()
+
+    mrenclave = None
+    for ext in cert.extensions:
+        if (ext.value.oid.dotted_string == "1.2.3.5"):
+            report = ast.literal_eval(ext.value.value.decode())
+            mrenclave = base64.b64decode(report["isvEnclaveQuoteBody"])[112:144].hex()
+            break
+
+    verified = (public_key_pem, mrenclave)
+    provider_certs.put(fingerprint, verified)
+    return verified
+
+def token_valid_until(payload):
+    try:
+        return datetime.strptime(payload["expiration_date"], "%Y-%m-%d")
+    except (KeyError, TypeError, ValueError):
+        return None
+
+verified_tokens = LRUCache(TOKEN_CACHE_SIZE)
+def verify_token(token, cert):
+    token_hash = hashlib.sha256((token + "," + cert).encode()).hexdigest()
+    cached = verified_tokens.get(token_hash)
+    if (cached is not None):
+        payload, valid_until = cached
+        if (valid_until is None or trusted_clock.now() <= valid_until):
+            return dict(payload)
+        verified_tokens.pop(token_hash)
+
+    # Verify Cert
+    public_key_pem, mrenclave = verify_provider_cert(cert)
+
+    # Verify JWT
     payload = jwt.decode(
         jwt=token,
-        key=public_key_pem.decode(),
+        key=public_key_pem,
         algorithms=["RS512"]
     )
     
     # Verify Indentity
-    with open(CONSUMER_CERT, "rb") as f:
-        client_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
-    
-    cname = client_cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value
-    if (payload["consumer"] != cname):
+    if (payload["consumer"] != CONSUMER_CN):
         raise RuntimeError("Invalid consumer")
     
-    for ext in cert.extensions:
-        if (ext.value.oid.dotted_string == "1.2.3.5"):
-            report = ast.literal_eval(ext.value.value.decode())
-            MRENCLAVE = base64.b64decode(report["isvEnclaveQuoteBody"])[112:144].hex()
-            if (MRENCLAVE != payload["app_ID"]):
-                raise RuntimeError("Invalid App")
-            else:
-                break
+    if (mrenclave is not None and mrenclave != payload["app_ID"]):
+        raise RuntimeError("Invalid App")
     
-    return payload
+    verified_tokens.put(token_hash, (payload, token_valid_until(payload)))
+    return dict(payload)
 
 def read_data_from_cache(file_path, client_cn):
-    with open(file_path, "r") as f:
-        cached_data = json.load(f)
-        if (cached_data["clientCN"] != client_cn):
-            print("Failed to load cached data due to invalid client CN.")
-        return cached_data
+    cached_data = data_store.load(file_path)
+    if (cached_data is None):
+        return None
+    if (cached_data["clientCN"] != client_cn):
+        print("Failed to load cached data due to invalid client CN.")
+    return cached_data
+
+provider_sessions = HostSessions()
+def load_provider_ssl_context():
+    # the consumer certificate and key are read once here, not on every request
+    context = PooledSSLContext()
+    context.load_verify_locations(cafile=TRUSTED_CA_CERT)
+    context.load_cert_chain(certfile=CONSUMER_CERT, keyfile=SKEY)
+    provider_sessions.ssl_context = context
 
 CERTIFICATE_DN_CHECKED = False
 def receive_data(data_id, received_cert_cn):
     global CERTIFICATE_DN_CHECKED
     if (not CERTIFICATE_DN_CHECKED):
-        with open(CONSUMER_CERT, "rb") as cert_file:
-            cert_data = cert_file.read()
-        cert = x509.load_pem_x509_certificate(cert_data, default_backend())
-        consumer_cn = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value
-        if (received_cert_cn != consumer_cn):
+        if (received_cert_cn != CONSUMER_CN):
             raise RuntimeError("Invalid Client Certificate (failed to verify client CN)")
         CERTIFICATE_DN_CHECKED = True
     
-    data = json.loads(requests.get(data_id, verify=TRUSTED_CA_CERT, params={"data_id": data_id}, cert=(CONSUMER_CERT, SKEY)).text)
+    data = json.loads(provider_sessions.get(data_id).get(data_id, params={"data_id": data_id}).text)
     data["path"] = "./data/" + data_id.replace("/", "-")
-    data["clientCN"] = client_cn
+    data["clientCN"] = received_cert_cn
     return data
 
+class PersistenceQueue:
+    # Usage-state updates are coalesced per path and written by a background thread in batches.
+    # A session waits for the ticket of its updates before it releases a result, so a counter
+    # decrement is on disk before anyone sees the output it paid for.
+    def __init__(self, write_batch):
+        self.write_batch = write_batch
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()
+        self.enqueued = 0
+        self.flushed = 0
+        self.started = False
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        self.started = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def put(self, path, counter):
+        with self.cond:
+            self.pending.pop(path, None)
+            self.pending[path] = counter
+            self.enqueued += 1
+            self.cond.notify_all()
+
+    def ticket(self):
+        with self.cond:
+            return self.enqueued
+
+    def wait(self, ticket):
+        with self.cond:
+            while (self.started and self.flushed < ticket):
+                self.cond.wait()
+
+    def depth(self):
+        with self.cond:
+            return len(self.pending)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while (not self.pending):
+                    self.cond.wait()
+                batch = self.pending
+                ticket = self.enqueued
+                self.pending = OrderedDict()
+
+            start = time.monotonic()
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                print(f"Failed to persist usage state: {e}")
+                # keep the batch unless a newer update for the same path arrived meanwhile
+                with self.cond:
+                    for path, counter in self.pending.items():
+                        batch.pop(path, None)
+                        batch[path] = counter
+                    self.pending = batch
+                time.sleep(1)
+                continue
+
+            with self.cond:
+                self.flushed = ticket
+                self.last_flush_ms = (time.monotonic() - start) * 1000
+                self.cond.notify_all()
+
+class DataStore:
+    # Decoded datasets kept in memory across sessions, bounded by the size of their JSON encoding.
+    # The usage state (counter) lives apart from the immutable record: the record file under ./data
+    # is written once, and counter updates are appended to a journal as one short line each by the
+    # persistence queue.
+    def __init__(self, max_bytes, journal_path):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.journal_path = journal_path
+        self.journal = None
+        self.journal_lines = 0
+        self.queue = PersistenceQueue(self.write_batch)
+
+    def open_journal(self):
+        # replay the journal; a torn last line from a crash is ignored
+        if (os.path.isfile(self.journal_path)):
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        path, counter = json.loads(line)
+                    except ValueError:
+                        continue
+                    if (counter is None):
+                        self.counters.pop(path, None)
+                    else:
+                        self.counters[path] = counter
+        self.compact(dict(self.counters))
+        self.queue.start()
+
+    def compact(self, counters):
+        # rewrite the journal with one line per live entry, then switch to it atomically
+        if (self.journal is not None):
+            self.journal.close()
+        with open(self.journal_path + ".tmp", "w") as f:
+            for path, counter in counters.items():
+                f.write(json.dumps([path, counter]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.journal_path + ".tmp", self.journal_path)
+        self.journal = open(self.journal_path, "a")
+        self.journal_lines = len(counters)
+
+    def write_batch(self, batch):
+        # runs on the persistence thread: one write and one fsync per batch
+        self.journal.write("".join(json.dumps([path, counter]) + "\n" for path, counter in batch.items()))
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_lines += len(batch)
+        with self.lock:
+            counters = dict(self.counters)
+        if (self.journal_lines > max(USAGE_JOURNAL_COMPACT_MIN, 4 * len(counters))):
+            self.compact(counters)
+
+    def checkout(self, path):
+        # a per-session view: the payload is shared, the condition is the session's own copy
+        record = dict(self.entries[path][0])
+        record["condition"] = dict(record["condition"], counter=self.counters[path])
+        return record
+
+    def insert(self, path, record, size, counter):
+        if (path in self.entries):
+            self.size -= self.entries.pop(path)[1]
+        self.counters[path] = counter
+        if (size > self.max_bytes):
+            return
+        self.entries[path] = (record, size)
+        self.size += size
+        while (self.size > self.max_bytes):
+            self.size -= self.entries.popitem(last=False)[1][1]
+
+    def load(self, path):
+        with self.lock:
+            if (path in self.entries):
+                self.entries.move_to_end(path)
+                return self.checkout(path)
+        if (not os.path.isfile(path)):
+            return None
+        with open(path, "r") as f:
+            record = json.load(f)
+        with self.lock:
+            counter = self.counters.get(path, record["condition"]["counter"])
+            self.insert(path, record, os.path.getsize(path), counter)
+            if (path in self.entries):
+                return self.checkout(path)
+        record["condition"]["counter"] = counter
+        return record
+
+    def add(self, record):
+        encoded = json.dumps(record)
+        with open(record["path"], "w") as f:
+            f.write(encoded)
+        with self.lock:
+            if (record["path"] in self.counters):
+                # stale state of an earlier copy of this data
+                self.queue.put(record["path"], record["condition"]["counter"])
+            self.insert(record["path"], record, len(encoded), record["condition"]["counter"])
+            if (record["path"] in self.entries):
+                return self.checkout(record["path"])
+        return record
+
+    def save_usage(self, record):
+        with self.lock:
+            if (self.counters.get(record["path"]) == record["condition"]["counter"]):
+                return
+            self.counters[record["path"]] = record["condition"]["counter"]
+            self.queue.put(record["path"], record["condition"]["counter"])
+
+    def remove(self, path):
+        with self.lock:
+            if (path in self.entries):
+                self.size -= self.entries.pop(path)[1]
+            if (self.counters.pop(path, None) is not None):
+                self.queue.put(path, None)
+        os.remove(path)
+
+data_store = DataStore(DATA_CACHE_MAX_BYTES, USAGE_JOURNAL)
+
 def cache_data(data, file_path):
-    with open(file_path, "w") as f:
-        f.write(json.dumps(data))
+    return data_store.add(data)
 
-def remove_data(data):
+def remove_data(data, session):
+    # a model trained on the data holds its rows, so it goes with the data
+    plib.svm_models.discard(data["data"])
     try:
-        os.remove(data["path"])
+        data_store.remove(data["path"])
     except Exception as e:
         print("Failed to remove cached data")
-        tls_socket.send("Failed to remove cached data".encode())
+        session.send("Failed to remove cached data")
 
 def store_data(data):
-    with open(data["path"], "w") as f:
-        f.write(json.dumps(data))
+    data_store.save_usage(data)
 
-def request(client_cn, tokens):
+class Session:
+    # per-connection state; nothing here is shared between sessions
+    def __init__(self, tls_socket, fromaddr):
+        self.tls_socket = tls_socket
+        self.fromaddr = fromaddr
+        self.handshakes = 0
+        self.resumed_handshakes = 0
+        self.lock = threading.Lock()
+        self.framed = False
+        self.compress = False
 
-    cached = False
+    def send(self, msg):
+        if (not self.framed):
+            self.tls_socket.send(msg.encode())
+            return
+        self.send_frame(msg.encode(), 0)
+
+    def send_frame(self, payload, flags):
+        if (self.compress and len(payload) >= FRAME_COMPRESS_MIN):
+            payload = zlib.compress(payload)
+            flags |= FRAME_COMPRESSED
+        self.tls_socket.sendall(RESPONSE_FRAME.pack(FRAME_VERSION, flags, len(payload)) + payload)
+
+    def close(self):
+        # tells a framed client that no more results follow
+        if (self.framed):
+            self.send_frame(b"", FRAME_END)
+
+    def count_handshake(self, resumed):
+        with self.lock:
+            self.handshakes += 1
+            if (resumed):
+                self.resumed_handshakes += 1
 
+# an entry lives as long as a session holds (or waits for) its lock
+DATA_LOCKS = weakref.WeakValueDictionary()
+DATA_LOCKS_LOCK = threading.Lock()
+def lock_data(data_ids):
+    # serialize sessions that use the same data so that counter updates are not lost
+    locks = []
+    with DATA_LOCKS_LOCK:
+        for data_id in sorted(set(data_ids)):
+            locks.append(DATA_LOCKS.setdefault(data_id, threading.Lock()))
+    for lock in locks:
+        lock.acquire()
+    return locks
+
+def unlock_data(locks):
+    for lock in reversed(locks):
+        lock.release()
+
+def install_trusted_ca():
     with open(CA_CERT, "rb") as cert:
         with open(TRUSTED_CA_CERT, "wb") as trusted_cert:
             trusted_cert.write(cert.read())
-        
+
+def request(session, client_cn, tokens):
+
+    # sessions are accepted during the warm-up; tokens can only be verified after it
+    if (VERIFICATION_READY is not None):
+        VERIFICATION_READY.result()
+
     providers = []
     for line in tokens.split("\n")[:-1]:
         try:
@@ -287,7 +720,7 @@ def request(client_cn, tokens):
             import traceback
             traceback.print_exc()
 
-            tls_socket.send("Invalid Signature".encode())
+            session.send("Invalid Signature")
         except Exception as e:
             print("Invalid Certificate")
             print(f"Error: {e}")
@@ -296,73 +729,318 @@ def request(client_cn, tokens):
             import traceback
             traceback.print_exc()
 
-            tls_socket.send("Invalid Certificate".encode())
+            session.send("Invalid Certificate")
+
+    locks = lock_data([usage_statement["data_ID"] for usage_statement in providers])
+    try:
+        return use_data(session, client_cn, providers)
+    finally:
+        unlock_data(locks)
+
+class ReadOnlyView:
+    # lazy read-only view of a cached dict or list: nothing is copied up front, nested dicts and lists
+    # are wrapped when they are accessed. The wrapped container sits in a private slot and the view
+    # has no mutating methods; what process_data may do beyond that is checked by the analyzer.
+    __slots__ = ("_ReadOnlyView__target",)
+
+    def __init__(self, target):
+        object.__setattr__(self, "_ReadOnlyView__target", target)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    __delattr__ = __setattr__
+
+    def __len__(self):
+        return len(self.__target)
+
+    def __eq__(self, other):
+        if (isinstance(other, ReadOnlyView)):
+            other = other.__target
+        return self.__target == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.__target)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # a mutable copy for apps that need one
+        return copy.deepcopy(self.__target, memo)
+
+class ReadOnlyMapping(ReadOnlyView, Mapping):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return read_only(self._ReadOnlyView__target[key])
+
+    def __iter__(self):
+        return iter(self._ReadOnlyView__target)
+
+    def __contains__(self, key):
+        return key in self._ReadOnlyView__target
+
+class ReadOnlySequence(ReadOnlyView, Sequence):
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        return read_only(self._ReadOnlyView__target[index])
+
+    def __iter__(self):
+        return map(read_only, self._ReadOnlyView__target)
+
+def read_only(value):
+    if (isinstance(value, dict)):
+        return ReadOnlyMapping(value)
+    if (isinstance(value, list)):
+        return ReadOnlySequence(value)
+    return value
+
+def prepare_argument(data):
+    # the payload is shared with the data cache, so the app must not be able to modify it
+    if (ARGUMENT_MODE == "view"):
+        return read_only(data)
+    return copy.deepcopy(data)
+
+def acquire_data(session, usage_statement, client_cn):
+    HANDSHAKE_SCOPE.session = session
+    try:
+        return acquire_and_check_data(usage_statement, client_cn)
+    finally:
+        HANDSHAKE_SCOPE.session = None
+
+def acquire_and_check_data(usage_statement, client_cn):
+    # is data cached?
+    file_path = "./data/" + usage_statement["data_ID"].replace("/", "-")
+    # cache acquisition phase
+    data = read_data_from_cache(file_path, client_cn)
+    if (data is not None):
+        cached = True
+    else:
+        # data acquisition phase
+        is_succeeded, data = data_acquisition(usage_statement["data_ID"], client_cn)
+        if (not is_succeeded):
+            return None, False, False, 0
+        cached = False
+
+    # data usage condition check phase
+    is_ok, is_expired = check_condition_phase(data["condition"])
+    return data, cached, is_ok, is_expired
+
+ACQUISITION_EXECUTOR = ThreadPoolExecutor(max_workers=ACQUISITION_WORKERS)
+def use_data(session, client_cn, providers):
+
+    cached = False
 
     provided_data_uc = []
     provided_data = []
     is_met_condition = True
 
     start = datetime.now()
-    for usage_statement in providers:
-        # is data cached?
-        file_path = "./data/" + usage_statement["data_ID"].replace("/", "-")
-        if (os.path.isfile(file_path)):
-            # cache acquisition phase
-            provided_data_uc.append(read_data_from_cache("./data/" + usage_statement["data_ID"].replace("/", "-"), client_cn))
-            cached = True
-        else:
-            # data acquisition phase
-            is_succeeded, data = data_acquisition(usage_statement["data_ID"], client_cn)
-            if (not is_succeeded):
-                print("Failed to receive data: " + usage_statement["data_ID"])
-                tls_socket.send("Failed to receive data".encode())
-                continue
-            provided_data_uc.append(data)
+    # fetch and check all data concurrently, then assemble the results in token order
+    futures = [ACQUISITION_EXECUTOR.submit(acquire_data, session, usage_statement, client_cn) for usage_statement in providers]
+    for usage_statement, future in zip(providers, futures):
+        data, is_cached, is_ok, is_expired = future.result()
+        if (data is None):
+            print("Failed to receive data: " + usage_statement["data_ID"])
+            session.send("Failed to receive data")
+            continue
+        provided_data_uc.append(data)
+        cached = cached or is_cached
 
-        # data usage condition check phase
-        is_ok, is_expired = check_condition_phase(provided_data_uc[-1]["condition"])
         if (not is_ok):
             print("The usage condition is not met: " + usage_statement["data_ID"])
-            tls_socket.send("The usage condition is not met".encode())
+            session.send("The usage condition is not met")
             if (is_expired == 0):
                 provided_data_uc[-1]["expired"] = True
             is_met_condition = False
         else:
             if (int(usage_statement["arg_num"]) == len(provided_data) + 1):
-                provided_data.append(copy.deepcopy(provided_data_uc[-1]["data"]))
+                provided_data.append(prepare_argument(provided_data_uc[-1]["data"]))
             else:
                 print("Invalid argument number.")
-                tls_socket.send("Invalid argument number".encode())
+                session.send("Invalid argument number")
                 continue
     
     start_process_data = datetime.now()
     if (is_met_condition):
         processed_data = process_data(*provided_data)
         
-        # count decrement after processing data
+        # count decrement after processing data, so a failed computation does not use up a count
         for data in provided_data_uc:
             if (data["condition"]["counter"] != ""):
                 data["condition"]["counter"] = str(int(data["condition"]["counter"]) - 1)
-        
-        # output
-        tls_socket.send(processed_data.encode())
     
-    # data storing
+    # data storing (queued; written in the background)
     start_store_data = datetime.now()
+    ticket = data_store.queue.ticket()
     for data in provided_data_uc:
         expired = data_saving(data)
         if (expired):
-            remove_data(data)
+            remove_data(data, session)
+    stored_ticket = data_store.queue.ticket()
+
+    # output, once the counter decrement is on disk
+    start_persist_wait = datetime.now()
+    if (is_met_condition and stored_ticket > ticket):
+        data_store.queue.wait(stored_ticket)
+    end_persist_wait = datetime.now()
+    if (is_met_condition):
+        session.send(processed_data)
 
     end = datetime.now()
 
-    elapsed_check_policy_ms = round((start_process_data - start).total_seconds() * 1000)
-    elapsed_process_data_ms = round((start_store_data - start_process_data).total_seconds() * 1000)
-    elapsed_store_data_ms   = round((end - start_store_data).total_seconds() * 1000)
-    elapsed_ms              = round((end - start).total_seconds() * 1000)
+    elapsed_check_policy_ms  = round((start_process_data - start).total_seconds() * 1000)
+    elapsed_process_data_ms  = round((start_store_data - start_process_data).total_seconds() * 1000)
+    elapsed_store_data_ms    = round((start_persist_wait - start_store_data).total_seconds() * 1000)
+    elapsed_persist_wait_ms  = round((end_persist_wait - start_persist_wait).total_seconds() * 1000)
+    elapsed_ms               = round((end - start).total_seconds() * 1000)
+
+    return start, end, elapsed_check_policy_ms, elapsed_process_data_ms, elapsed_store_data_ms, elapsed_persist_wait_ms, elapsed_ms, is_met_condition, cached
+
+def recv_exact(sock, size, received=b""):
+    # reads exactly size bytes into one preallocated buffer, starting with bytes that were already received
+    buf = bytearray(size)
+    view = memoryview(buf)
+    n = min(len(received), size)
+    view[:n] = received[:n]
+    while (n < size):
+        read = sock.recv_into(view[n:], size - n)
+        if (read == 0):
+            raise ConnectionError("Connection closed in the middle of a frame")
+        n += read
+    return buf, received[size:]
+
+def receive_tokens(session):
+    first = session.tls_socket.recv(1024)
+    if (not first.startswith(FRAME_MAGIC[:1])):
+        # legacy protocol: the line count followed by the tokens
+        msg2 = ""
+        for _ in range(int(first.decode())):
+            msg2 += session.tls_socket.recv(2048).decode()
+        return msg2
+
+    header, rest = recv_exact(session.tls_socket, FRAME_HEADER.size, first)
+    magic, version, flags, length = FRAME_HEADER.unpack(header)
+    session.framed = True
+    if (magic != FRAME_MAGIC or version != FRAME_VERSION):
+        session.send(f"Unsupported protocol version: {version}")
+        return None
+    if (length > FRAME_MAX_PAYLOAD):
+        session.send(f"Token payload too large: {length} bytes")
+        return None
+
+    payload, _ = recv_exact(session.tls_socket, length, rest)
+    if (flags & FRAME_COMPRESSED):
+        session.compress = True
+        decompressor = zlib.decompressobj()
+        payload = decompressor.decompress(payload, FRAME_MAX_PAYLOAD)
+        if (decompressor.unconsumed_tail):
+            session.send("Token payload too large")
+            return None
+    return payload.decode()
+
+def handle_session(context, client_socket, fromaddr, f):
+    accepted_at = datetime.now()
+    try:
+        # the TLS handshake runs in the worker thread, not in the accept loop
+        with context.wrap_socket(client_socket, server_side=True) as tls_socket:
+            session = Session(tls_socket, fromaddr)
+            log_message(f, f"Client connected: {fromaddr}")
+
+            client_cert = tls_socket.getpeercert()
+            if not client_cert:
+                log_message(f, "Client certificate not found.")
+                return
+
+            subject = dict(x[0] for x in client_cert['subject'])
+            client_cn = subject['commonName']
+            log_message(f, f"Common Name: {client_cn}")
+
+            msg2 = receive_tokens(session)
+            if (msg2 is None):
+                session.close()
+                return
+
+            start, end, elapsed_check_policy_ms, elapsed_process_data_ms, elapsed_store_data_ms, elapsed_persist_wait_ms, elapsed_ms, is_met_condition, cached = request(session, client_cn, msg2)
+
+            msg = f"Session completed (start:{start.isoformat(sep=' ', timespec='milliseconds')}, end:{end.isoformat(sep=' ', timespec='milliseconds')}, elapsed_check_policy_ms:{elapsed_check_policy_ms}, elapsed_process_data_ms:{elapsed_process_data_ms}, elapsed_store_data_ms:{elapsed_store_data_ms}, elapsed_persist_wait_ms:{elapsed_persist_wait_ms}, elapsed_ms:{elapsed_ms}, handshakes:{session.handshakes}, resumed_handshakes:{session.resumed_handshakes}, persist_queue_depth:{data_store.queue.depth()}, persist_flush_ms:{data_store.queue.last_flush_ms:.1f}, is_met_condition:{is_met_condition}, cached:{cached})"
+            log_message(f, msg)
+
+            session.send(msg)
+            session.close()
+            report_first_request(f, accepted_at)
+    except Exception as e:
+        log_message(f, f"Session failed: {fromaddr} ({type(e).__name__}: {e})")
+        try:
+            client_socket.close()
+        except Exception:
+            pass
+
+def wait_for_port(bind_socket, port, f):
+    # A warm standby enclave (--standby) retries until the serving enclave exits and releases the port,
+    # so only one enclave at a time owns ./certs, ./data and the usage journal. Standbys only shorten
+    # the failover after an exit; they serve nothing while the port is taken.
+    waiting = False
+    while True:
+        try:
+            bind_socket.bind(('0.0.0.0', port))
+            break
+        except OSError as e:
+            if (e.errno != errno.EADDRINUSE):
+                raise
+            if (not waiting):
+                log_message(f, f"Port {port} is in use, waiting as a standby")
+                waiting = True
+            time.sleep(PORT_RETRY_INTERVAL)
+    if (waiting):
+        log_message(f, f"Took over port {port}")
+
+def import_deferred_modules():
+    for name in DEFERRED_MODULES:
+        importlib.import_module(name)
+    urllib3.disable_warnings(urllib3.exceptions.SecurityWarning)
 
-    return start, end, elapsed_check_policy_ms, elapsed_process_data_ms, elapsed_store_data_ms, elapsed_ms, is_met_condition, cached
+def report_bench(f, name, start, end, elapsed_ms, fields=""):
+    msg = f"___BENCH___ {name} (Start:{start.strftime('%Y-%m-%d %H:%M:%S')}, End:{end.strftime('%Y-%m-%d %H:%M:%S')}, Duration_ms:{round(elapsed_ms)}, enclave:{ENCLAVE_ID}{fields})"
+    print(msg, flush=True)
+    log_message(f, msg)
+
+def report_startup(f, launched_at_ms, port_wait_ms):
+    # launched_at_ms is taken by the supervisor right before gramine-sgx starts the enclave;
+    # enclave init ends when main.py starts, interpreter init when the enclave accepts sessions
+    launched = datetime.fromtimestamp(launched_at_ms / 1000)
+    started = datetime.fromtimestamp(STARTED_AT)
+    ready = datetime.now()
+    report_bench(f, "Enclave init", launched, started, (started - launched).total_seconds() * 1000)
+    report_bench(f, "Interpreter init", started, ready, (ready - started).total_seconds() * 1000 - port_wait_ms, f", port_wait_ms:{round(port_wait_ms)}")
+    report_bench(f, "Enclave startup", launched, ready, (ready - launched).total_seconds() * 1000 - port_wait_ms, f", port_wait_ms:{round(port_wait_ms)}")
+
+def report_warmup(f, future, port_wait_ms):
+    # the deferred imports and the verification material, which overlap with the first sessions
+    end = datetime.now()
+    started = datetime.fromtimestamp(STARTED_AT)
+    if (future.exception() is not None):
+        log_message(f, f"Warm-up failed ({type(future.exception()).__name__}: {future.exception()})")
+        return
+    report_bench(f, "Warm-up", started, end, (end - started).total_seconds() * 1000 - port_wait_ms, f", port_wait_ms:{round(port_wait_ms)}")
 
+FIRST_REQUEST_LOCK = threading.Lock()
+FIRST_REQUEST_DONE = False
+def report_first_request(f, accepted_at):
+    # latency of the first session served by this enclave, from accept to the result being sent
+    global FIRST_REQUEST_DONE
+    with FIRST_REQUEST_LOCK:
+        if (FIRST_REQUEST_DONE):
+            return
+        FIRST_REQUEST_DONE = True
+    end = datetime.now()
+    report_bench(f, "First request", accepted_at, end, (end - accepted_at).total_seconds() * 1000)
+
+LOG_LOCK = threading.Lock()
 def log_message(f, message):
     """
     Write a timestamped message to the file object f.
@@ -370,13 +1048,37 @@ def log_message(f, message):
     # Get the current time in "YYYY-MM-DD HH:MM:SS" format
     timestamp = datetime.now().isoformat(sep=' ', timespec="milliseconds")
     # Write a log line
-    f.write(f"[{timestamp}] {message}\n")
-    # Flush the buffer to ensure the message is written immediately
-    f.flush()
+    with LOG_LOCK:
+        f.write(f"[{timestamp}] {message}\n")
+        # Flush the buffer to ensure the message is written immediately
+        f.flush()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=SESSION_WORKERS, help="number of sessions handled concurrently")
+    parser.add_argument("--backlog", type=int, default=LISTEN_BACKLOG, help="listen backlog of the session port")
+    parser.add_argument("--acquisition-workers", type=int, default=ACQUISITION_WORKERS, help="number of data items fetched concurrently")
+    parser.add_argument("--time-max-age", type=int, default=TRUSTED_TIME_MAX_AGE, help="seconds the trusted time is extrapolated before it is fetched again")
+    parser.add_argument("--data-cache-mb", type=int, default=DATA_CACHE_MAX_BYTES // (1024 * 1024), help="size bound of the in-memory decoded data cache")
+    parser.add_argument("--argument-mode", choices=["view", "copy"], default=ARGUMENT_MODE, help="pass data to process_data as deep copies or lazy read-only views (no copy)")
+    parser.add_argument("--location-ttl", type=int, default=LOCATION_CACHE_TTL, help="seconds the geolocation result is cached")
+    parser.add_argument("--enclave-id", default=ENCLAVE_ID, help="id of this enclave in run.sh (0: primary, 1..: standbys)")
+    parser.add_argument("--standby", action="store_true", help="wait warm until the port is free instead of failing to bind (failover only, adds no capacity)")
+    parser.add_argument("--launched-at", type=int, default=0, help="epoch milliseconds at which the supervisor launched this enclave")
+    args = parser.parse_args()
+
+    trusted_clock.max_age = args.time_max_age
+    location_cache.ttl = args.location_ttl
+    data_store.max_bytes = args.data_cache_mb * 1024 * 1024
+    ARGUMENT_MODE = args.argument_mode
+    ENCLAVE_ID = args.enclave_id
+
+    ACQUISITION_EXECUTOR = ThreadPoolExecutor(max_workers=args.acquisition_workers)
+
     with open('/logs/app.log', mode='a', encoding='utf-8') as f:
-        urllib3.disable_warnings(urllib3.exceptions.SecurityWarning)
+        # the deferred imports run while the port is bound (or while a standby waits for it)
+        warmup = ThreadPoolExecutor(max_workers=1)
+        warmup.submit(import_deferred_modules)
         
         context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         context.load_cert_chain(certfile=DUMMY_CERT, keyfile=DUMMY_KEY)
@@ -387,35 +1089,31 @@ if __name__ == "__main__":
         bind_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         port = 8002
-        bind_socket.bind(('0.0.0.0', port))
-        bind_socket.listen(1)
+        port_wait_start = time.monotonic()
+        if (args.standby):
+            wait_for_port(bind_socket, port, f)
+        else:
+            bind_socket.bind(('0.0.0.0', port))
+        port_wait_ms = (time.monotonic() - port_wait_start) * 1000
         
-        log_message(f, f"Start server (port:{port})")
-        while True:
-            log_message(f, f"Waiting for a connection...")
-            client_socket, fromaddr = bind_socket.accept()
-            with context.wrap_socket(client_socket, server_side=True) as tls_socket:
-                log_message(f, f"Client connected: {fromaddr}")
-
-                client_cert = tls_socket.getpeercert()
-                if not client_cert:
-                    log_message(f, "Client certificate not found.")
-                    exit(1)
-
-                subject = dict(x[0] for x in client_cert['subject'])
-                client_cn = subject['commonName']
-                log_message(f, f"Common Name: {client_cn}")
-
-                msg1 = tls_socket.recv(1024).decode()
-                msg2 = ""
-                for _ in range(int(msg1)):
-                    msg2 += tls_socket.recv(2048).decode()
-
-                start, end, elapsed_check_policy_ms, elapsed_process_data_ms, elapsed_store_data_ms, elapsed_ms, is_met_condition, cached = request(client_cn, msg2)
-
-                msg = f"Session completed (start:{start.isoformat(sep=' ', timespec='milliseconds')}, end:{end.isoformat(sep=' ', timespec='milliseconds')}, elapsed_check_policy_ms:{elapsed_check_policy_ms}, elapsed_process_data_ms:{elapsed_process_data_ms}, elapsed_store_data_ms:{elapsed_store_data_ms}, elapsed_ms:{elapsed_ms}, is_met_condition:{is_met_condition}, cached:{cached})"
-                log_message(f, msg)
-
-                tls_socket.send(msg.encode('utf-8'))
+        install_trusted_ca()
+        load_provider_ssl_context()
+        data_store.open_journal()
+        
+        # sessions are accepted right away; the warm-up thread parses the verification material
+        # after the imports, and request() waits for that before it verifies tokens
+        bind_socket.listen(args.backlog)
+        VERIFICATION_READY = warmup.submit(load_verification_material)
+        
+        if (args.launched_at):
+            report_startup(f, args.launched_at, port_wait_ms)
+            VERIFICATION_READY.add_done_callback(lambda future: report_warmup(f, future, port_wait_ms))
+        
+        log_message(f, f"Start server (port:{port}, enclave:{args.enclave_id}, workers:{args.workers}, backlog:{args.backlog})")
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            while True:
+                log_message(f, f"Waiting for a connection...")
+                client_socket, fromaddr = bind_socket.accept()
+                executor.submit(handle_session, context, client_socket, fromaddr, f)
 
     bind_socket.close()
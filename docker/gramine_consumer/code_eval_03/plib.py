@@ -1,29 +1,247 @@
+import bisect
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+SVM_PARAMS = '-s 0 -t 2 -d 3 -g 0.5 -r 0 -n 0.5 -m 100 -c 5 -e 0.1 -p 0.1 -h 1 -b 0'
+SVM_MODEL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
 # Output:
 def get_maxKey(dict):
+    # keys are collected and joined once instead of growing the result string
     max = 0
-    ret = None
+    keys = []
     for k, v in dict.items():
         if (v > max):
             max = v
-            ret = str(k)
-        elif (v == max):
-            ret += "," + str(k)
-    return ret
+            keys = [str(k)]
+        elif (v == max and keys):
+            keys.append(str(k))
+    return ",".join(keys) if keys else None
+# Output: values
+def count_values(values):
+    """
+    count_values(values) -> {value: count} in order of first appearance
+
+    Counting histogram over an iterable (consumed in one pass) or a NumPy array.
+    """
+    # NumPy arrays (anything with ravel) are counted by NumPy, numpy is not imported otherwise
+    if (hasattr(values, "ravel")):
+        import numpy
+        keys, first, counts = numpy.unique(values.ravel(), return_index=True, return_counts=True)
+        order = numpy.argsort(first, kind="stable")
+        return dict(zip(keys[order].tolist(), counts[order].tolist()))
+    return dict(Counter(values))
+# Output: values
+def mode(values):
+    """
+    mode(values) -> the most frequent values joined by "," (all of them on a tie), like get_maxKey
+
+    The result is made of input values, so it keeps their taint.
+    """
+    return get_maxKey(count_values(values))
+# Output: values
+def top_k(values, k):
+    """
+    top_k(values, k) -> [(value, count), ...] of the k most frequent values, most frequent first
+
+    Values tied with the k-th count are all included; equal counts keep the order of first appearance.
+    """
+    counts = sorted(count_values(values).items(), key=lambda item: -item[1])
+    if (k <= 0 or not counts):
+        return []
+    threshold = counts[min(k, len(counts)) - 1][1]
+    return [item for item in counts if item[1] >= threshold]
+# Output:
+def count_buckets(values, edges):
+    """
+    count_buckets(values, edges) -> [count, ...] with len(edges) + 1 buckets
+
+    edges must be sorted: bucket 0 counts values below edges[0], bucket i values in
+    [edges[i-1], edges[i]), and the last bucket values from edges[-1] up.
+    """
+    if (hasattr(values, "ravel")):
+        import numpy
+        return numpy.bincount(numpy.searchsorted(edges, values.ravel(), side="right"), minlength=len(edges) + 1).tolist()
+    counts = [0] * (len(edges) + 1)
+    for v in values:
+        counts[bisect.bisect_right(edges, v)] += 1
+    return counts
+# Output: values
+def count_rounded(values, width):
+    """
+    count_rounded(values, width) -> {v // width * width: count} in order of first appearance
+    """
+    if (hasattr(values, "ravel")):
+        return count_values(values // width * width)
+    return dict(Counter(v // width * width for v in values))
+class SVMModelCache:
+    # Trained models keyed by the digest of the training data and the parameter string, kept in
+    # memory only as an LRU bounded by the size of the training data. A model holds its support
+    # vectors, which are training rows, so it is never written out and is dropped with its data
+    # (remove_data in main.py calls discard).
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def key(self, data, params):
+        return hashlib.sha256((params + "\n" + data).encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if (key in self.entries):
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+        return None
+
+    def put(self, key, model, size):
+        with self.lock:
+            if (key in self.entries):
+                self.size -= self.entries.pop(key)[1]
+            if (size > self.max_bytes):
+                return
+            self.entries[key] = (model, size)
+            self.size += size
+            while (self.size > self.max_bytes):
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def discard(self, data):
+        # data: the payload passed to run_svm; anything else has no model
+        if (not isinstance(data, dict) or not isinstance(data.get("data"), str)):
+            return
+        key = self.key(data["data"].replace('\\n', '\n'), SVM_PARAMS)
+        with self.lock:
+            if (key in self.entries):
+                self.size -= self.entries.pop(key)[1]
+
+svm_models = SVMModelCache(SVM_MODEL_CACHE_MAX_BYTES)
 # Output:
 def run_svm(data):
+    from libsvm import svm
     from libsvm.svmutil import svm_train
-    y, x  = svm_read_problem_from_data(data["data"].replace('\\n', '\n'))
-    return svm_train(y, x, '-s 0 -t 2 -d 3 -g 0.5 -r 0 -n 0.5 -m 100 -c 5 -e 0.1 -p 0.1 -h 1 -b 0')
-# Output:
+    text = data["data"].replace('\\n', '\n')
+    key = svm_models.key(text, SVM_PARAMS)
+    model = svm_models.get(key)
+    if (model is None):
+        # libsvm with scipy support builds the problem straight from a CSR matrix instead of one dict per row
+        y, x  = svm_read_problem_from_data(text, return_scipy=hasattr(svm, "csr_to_problem"))
+        model = svm_train(y, x, SVM_PARAMS)
+        svm_models.put(key, model, len(text))
+    return model
+# Output: data
 def svm_read_problem_from_data(data, return_scipy=False):
-    import scipy
+    """
+    svm_read_problem_from_data(data, return_scipy=False) -> [y, x], y: list, x: list of dictionary
+    svm_read_problem_from_data(data, return_scipy=True)  -> [y, x], y: ndarray, x: csr_matrix
+
+    Read LIBSVM-format data and return labels y and data instances x.
+    The CSR result is tokenized at once with NumPy and holds the same entries as the
+    dictionaries of svm_read_problem_from_lines, which also handles (and reports) malformed input.
+    """
+    if not return_scipy:
+        return svm_read_problem_from_lines(data)
+    import numpy
+    from scipy import sparse
+    arrays = svm_read_problem_arrays(data)
+    if arrays is None:
+        prob_y, prob_x = svm_read_problem_from_lines(data)
+        row_ptr = numpy.concatenate(([0], numpy.cumsum([len(xi) for xi in prob_x]))).astype(numpy.int64)
+        indices = numpy.array([i for xi in prob_x for i in xi], dtype=numpy.int64)
+        values = numpy.array([v for xi in prob_x for v in xi.values()], dtype=numpy.float64)
+        arrays = (numpy.asarray(prob_y), row_ptr, indices, values)
+    labels, row_ptr, indices, values = arrays
+
+    # same entries as the dictionaries: the last value of a repeated index wins, zeros are dropped
+    rows = numpy.repeat(numpy.arange(len(labels)), numpy.diff(row_ptr))
+    order = numpy.lexsort((indices, rows))
+    rows, indices, values = rows[order], indices[order], values[order]
+    keep = numpy.ones(len(rows), dtype=bool)
+    keep[:-1] = (rows[1:] != rows[:-1]) | (indices[1:] != indices[:-1])
+    keep &= values != 0
+    rows, indices, values = rows[keep], indices[keep], values[keep]
+    if len(indices) and indices.min() < 1:
+        raise ValueError("feature indices must start from 1")
+    row_ptr = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(rows, minlength=len(labels)))))
+    shape = (len(labels), int(indices.max()) if len(indices) else 0)
+    return (labels, sparse.csr_matrix((values, indices - 1, row_ptr), shape=shape))
+# Output: data
+def svm_read_problem_arrays(data):
+    """
+    svm_read_problem_arrays(data) -> (labels, row_ptr, indices, values) as NumPy arrays,
+    with the features of row i in indices/values[row_ptr[i]:row_ptr[i+1]] in input order.
+
+    Only plain decimal numbers ([+-]digits[.digits], at most 15 characters) are converted here,
+    where NumPy's parser gives the same doubles as float(); None is returned for anything else
+    (exponents, nan, malformed lines), which is left to svm_read_problem_from_lines.
+    """
+    import numpy
+    # like data.split("\n")[:-1], text after the last newline is not read
+    data = data[:data.rfind("\n") + 1]
+    try:
+        text = numpy.frombuffer(data.encode("ascii"), dtype=numpy.uint8)
+    except UnicodeEncodeError:
+        return None
+    if len(text) == 0:
+        return (numpy.zeros(0), numpy.zeros(1, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0))
+
+    space = (text == 32) | ((text >= 9) & (text <= 13))
+    newline = text == 10
+    colon = text == 58
+    word = ~space
+    token = word & ~colon
+    word_start = numpy.flatnonzero(word & ~numpy.concatenate(([False], word[:-1])))
+    token_first = token & ~numpy.concatenate(([False], token[:-1]))
+    token_start = numpy.flatnonzero(token_first)
+    token_end = numpy.flatnonzero(token & ~numpy.concatenate((token[1:], [False]))) + 1
+    if len(word_start) == 0:
+        return None
+
+    # each line is a label followed by index:value words
+    newline_pos = numpy.flatnonzero(newline)
+    n_lines = len(newline_pos)
+    word_line = numpy.searchsorted(newline_pos, word_start)
+    first_word = numpy.concatenate(([True], word_line[1:] != word_line[:-1]))
+    colon_pos = numpy.flatnonzero(colon)
+    word_colons = numpy.bincount(numpy.searchsorted(word_start, colon_pos, side="right") - 1, minlength=len(word_start))
+    if (int(first_word.sum()) != n_lines or word_colons[first_word].any() or (word_colons[~first_word] != 1).any()
+            or not token[colon_pos - 1].all() or not token[colon_pos + 1].all()):
+        return None
+
+    nnz = numpy.bincount(numpy.searchsorted(newline_pos, colon_pos), minlength=n_lines)
+    row_ptr = numpy.concatenate(([0], numpy.cumsum(nnz)))
+    label_pos = row_ptr[:-1] * 2 + numpy.arange(n_lines)
+    is_feature = numpy.ones(len(token_start), dtype=bool)
+    is_feature[label_pos] = False
+    feature_pos = numpy.flatnonzero(is_feature)
+    is_index = numpy.zeros(len(token_start), dtype=bool)
+    is_index[feature_pos[0::2]] = True
+
+    # plain decimals: a sign only in front, at most one point (none in indices), at least one digit;
+    # with those rules only tokens of one or two characters ("+", "-.", ...) can lack a digit
+    digit = (text >= 48) & (text <= 57)
+    sign = (text == 43) | (text == 45)
+    point = text == 46
+    point_token = numpy.searchsorted(token_start, numpy.flatnonzero(point), side="right") - 1
+    token_len = token_end - token_start
+    if ((token & ~digit & ~sign & ~point).any() or (sign & ~token_first).any()
+            or (numpy.diff(point_token) == 0).any() or is_index[point_token].any()
+            or ((token_len <= 2) & ~digit[token_start] & ~digit[token_end - 1]).any() or token_len.max() > 15):
+        return None
+
+    numbers = numpy.fromstring(data.replace(":", " "), sep=" ")
+    if len(numbers) != len(token_start):
+        return None
+    return (numbers[label_pos], row_ptr, numbers[feature_pos[0::2]].astype(numpy.int64), numbers[feature_pos[1::2]])
+# Output: data
+def svm_read_problem_from_lines(data, return_scipy=False):
+    import numpy
     from scipy import sparse
     """
-    svm_read_problem(data_file_name, return_scipy=False) -> [y, x], y: list, x: list of dictionary
-    svm_read_problem(data_file_name, return_scipy=True)  -> [y, x], y: ndarray, x: csr_matrix
+    svm_read_problem_from_lines(data, return_scipy=False) -> [y, x], y: list, x: list of dictionary
+    svm_read_problem_from_lines(data, return_scipy=True)  -> [y, x], y: ndarray, x: csr_matrix
 
-    Read LIBSVM-format data from data_file_name and return labels y
-    and data instances x.
+    Line-by-line parser of LIBSVM-format data; reference for svm_read_problem_from_data.
     """
     prob_y = []
     prob_x = []
@@ -36,7 +254,7 @@ def svm_read_problem_from_data(data, return_scipy=False):
         if len(line) == 1: line += ['']
         label, features = line
         prob_y += [float(label)]
-        if scipy != None and return_scipy:
+        if return_scipy:
             nz = 0
             for e in features.split():
                 ind, val = e.split(":")
@@ -52,10 +270,10 @@ def svm_read_problem_from_data(data, return_scipy=False):
                 ind, val = e.split(":")
                 xi[int(ind)] = float(val)
             prob_x += [xi]
-    if scipy != None and return_scipy:
-        prob_y = scipy.array(prob_y)
-        prob_x = scipy.array(prob_x)
-        col_idx = scipy.array(col_idx)
-        row_ptr = scipy.array(row_ptr)
+    if return_scipy:
+        prob_y = numpy.asarray(prob_y)
+        prob_x = numpy.asarray(prob_x)
+        col_idx = numpy.asarray(col_idx)
+        row_ptr = numpy.asarray(row_ptr)
         prob_x = sparse.csr_matrix((prob_x, col_idx, row_ptr))
     return (prob_y, prob_x)
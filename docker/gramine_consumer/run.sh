@@ -2,6 +2,13 @@
 
 # set -x
 
+SESSION_WORKERS=${SESSION_WORKERS:-4}
+LISTEN_BACKLOG=${LISTEN_BACKLOG:-16}
+ACQUISITION_WORKERS=${ACQUISITION_WORKERS:-4}
+# warm standby enclaves for failover: they wait until the serving enclave exits and take over port 8002.
+# They add no capacity (only one enclave serves at a time) and each one holds its own EPC.
+STANDBY_ENCLAVES=${STANDBY_ENCLAVES:-0}
+
 if [ $# -ne 0 ]; then
     echo "Usage: ./run.sh"
     exit 1
@@ -23,10 +30,28 @@ else
     echo "Certificate already exists, skip generating certificate"
 fi
 
+# keep one enclave running and restart it whenever it exits
+function run_enclave() {
+    local enclave_id="$1"
+    shift
+    while true; do
+        gramine-sgx ./python code/main.py --workers $SESSION_WORKERS --backlog $LISTEN_BACKLOG --acquisition-workers $ACQUISITION_WORKERS \
+            --enclave-id $enclave_id --launched-at $(date +%s%3N) "$@"
+        echo "Enclave $enclave_id exited (status:$?), restarting"
+        sleep 1
+    done
+}
+
 # execute data processing 
-echo "========= Start data processing app =========="
-while true; do
-    gramine-sgx ./python code/main.py
-    sleep 1
-done
+echo "========= Start data processing app (standby enclaves:$STANDBY_ENCLAVES) =========="
+if [ "$STANDBY_ENCLAVES" -le 0 ]; then
+    run_enclave 0
+else
+    # every enclave waits for the port; whichever binds first serves, the others stay warm
+    trap 'trap - TERM INT; kill 0; exit 0' TERM INT
+    for enclave_id in $(seq 0 $STANDBY_ENCLAVES); do
+        run_enclave $enclave_id --standby &
+    done
+    wait
+fi
 echo "========= Finish data processing app =========="
\ No newline at end of file
@@ -1,7 +1,8 @@
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, Response, g, request, jsonify, make_response
 from flask_restx import Resource, Api, fields
 import ssl
 import werkzeug
+from werkzeug.wsgi import wrap_file
 from cryptography import x509
 from cryptography.x509.oid import NameOID
 from cryptography.hazmat.backends import default_backend
@@ -23,6 +24,21 @@ import MySQLdb
 from datetime import datetime, timedelta
 import subprocess
 import jwt
+import threading
+import time
+import signal
+import multiprocessing
+import shutil
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import io
+import zlib
+import bisect
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 data_file_path = "./data"
 
@@ -31,14 +47,68 @@ ROOTCA_CERT="./files/RootCA.pem"
 IAS_ROOTCA_CERT="./files/psuedo_Attestation_RootCA.pem"
 ISV_STATUS_VALUE_FILE = "./files/isvEnclaveQuoteStatus.json"
 REGISTRIES_API="./files/registries"
+SIGNING_KEY="./files/private.key"
+SERVER_CERT="./files/server.pem"
 
 DBUSER = "root"
 DBUSERPASS = "root"
+DBHOST = "provider-db"
 DBPORT = 3306
+DBNAME = "provider"
+
+# parameterized statements (values are escaped by the driver, never formatted into the SQL)
+POLICY_COLUMNS = "data_provider, data_type, data_id, data_consumer, data_processing, data_disclosing, data_counter, data_location, data_duration, data_expiration_date"
+SAVED_POLICY_COLUMNS = "consumer_subject, app_id, data_id, data_counter, data_location, data_duration, data_expiration_date"
+SELECT_POLICY = "SELECT " + POLICY_COLUMNS + " FROM policy WHERE data_id_hash = %s"
+SELECT_POLICIES = "SELECT " + POLICY_COLUMNS + " FROM policy WHERE data_id_hash IN ({})"
+SELECT_SAVED_POLICY = "SELECT " + SAVED_POLICY_COLUMNS + " FROM saved_policy WHERE app_id = %s AND data_id_hash = %s"
+SELECT_POLICY_PROVIDERS = "SELECT DISTINCT data_provider FROM policy WHERE data_id_hash = %s"
+INSERT_SAVED_POLICY = "INSERT INTO saved_policy(" + SAVED_POLICY_COLUMNS + ")VALUES(%s, %s, %s, %s, %s, %s, %s)"
+
+# connection pool shared by all request handlers
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get("DB_POOL_IDLE_TIMEOUT", "300"))
+DB_POOL_PING_INTERVAL = float(os.environ.get("DB_POOL_PING_INTERVAL", "10"))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.environ.get("DB_POOL_CHECKOUT_TIMEOUT", "10"))
+
+# cache of parsed data providing policies (keyed by data_id)
+POLICY_CACHE_SIZE = int(os.environ.get("POLICY_CACHE_SIZE", "1024"))
+POLICY_CACHE_TTL = float(os.environ.get("POLICY_CACHE_TTL", "60"))
+# client certificate CNs allowed to invalidate any cached policy (data providers may invalidate their own)
+POLICY_ADMINS = [cn for cn in os.environ.get("POLICY_ADMINS", "").split(",") if cn]
+
+# registry fan-out for data processing specs (keyed by MRENCLAVE)
+REGISTRY_WORKERS = int(os.environ.get("REGISTRY_WORKERS", "8"))
+REGISTRY_TIMEOUT = float(os.environ.get("REGISTRY_TIMEOUT", "10"))
+SPEC_CACHE_SIZE = int(os.environ.get("SPEC_CACHE_SIZE", "256"))
+SPEC_CACHE_TTL = float(os.environ.get("SPEC_CACHE_TTL", "3600"))
+
+# cache of attested client certificates (keyed by certificate fingerprint)
+ATTESTATION_CACHE_SIZE = int(os.environ.get("ATTESTATION_CACHE_SIZE", "1024"))
+ATTESTATION_REFRESH_INTERVAL = float(os.environ.get("ATTESTATION_REFRESH_INTERVAL", "600"))
 
 HOST_NAME = os.environ["HOST_NAME"]
 PRIVATE_CA = os.environ["PRIVATE_CA"]
 
+# "development" runs the Werkzeug debug server, "production" runs pre-forked threaded workers
+SERVER_MODE = os.environ.get("SERVER_MODE", "development")
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "4"))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "32"))
+
+# each pre-forked worker writes its metrics and stats here; /metrics and /stats/* merge them
+METRICS_SNAPSHOT_DIR = os.environ.get("METRICS_SNAPSHOT_DIR", "/tmp/provider-metrics")
+METRICS_SNAPSHOT_INTERVAL = float(os.environ.get("METRICS_SNAPSHOT_INTERVAL", "1"))
+
+# maximum number of declarations accepted by /apply/batch
+APPLY_BATCH_MAX = int(os.environ.get("APPLY_BATCH_MAX", "256"))
+
+# "stream" sends the stored JSON bytes without parsing them, "buffered" loads and re-serializes them
+DATA_DELIVERY_MODE = os.environ.get("DATA_DELIVERY_MODE", "stream")
+# compress /data responses of at least DATA_COMPRESSION_MIN_BYTES for clients that accept it (all of them are JSON)
+DATA_COMPRESSION = os.environ.get("DATA_COMPRESSION", "false").lower() == "true"
+DATA_COMPRESSION_MIN_BYTES = int(os.environ.get("DATA_COMPRESSION_MIN_BYTES", str(64 * 1024)))
+DATA_CHUNK_SIZE = int(os.environ.get("DATA_CHUNK_SIZE", str(64 * 1024)))
+
 class DataProcessingSpecification:
     
     def __init__(self, app_ID, input, output):
@@ -120,11 +190,339 @@ class DataProvidingPolcy:
         self.duration = duration
         self.expiration_date = expiration_date
 
+class DBConnectionPool:
+
+    def __init__(self, size, idle_timeout, ping_interval, checkout_timeout, **connect_args):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.checkout_timeout = checkout_timeout
+        self.connect_args = connect_args
+        
+        # idle connections as (connection, released_at), most recently used last
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        
+        self.checkouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.in_use = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    @contextmanager
+    def connection(self):
+        start = time.monotonic()
+        if (not self.slots.acquire(timeout=self.checkout_timeout)):
+            raise RuntimeError("Timed out waiting for a database connection")
+        
+        try:
+            conn = self.checkout()
+        except Exception:
+            self.slots.release()
+            raise
+        
+        wait_ms = (time.monotonic() - start) * 1000
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        
+        broken = False
+        try:
+            yield conn
+        except MySQLdb.OperationalError:
+            broken = True
+            raise
+        finally:
+            self.checkin(conn, broken)
+            self.slots.release()
+
+    def checkout(self):
+        while True:
+            with self.lock:
+                if (not self.idle):
+                    break
+                conn, released_at = self.idle.pop()
+            
+            idle_sec = time.monotonic() - released_at
+            if (idle_sec > self.idle_timeout):
+                self.discard(conn)
+                continue
+            
+            # health check connections that have been idle for a while
+            if (idle_sec > self.ping_interval):
+                try:
+                    conn.ping()
+                except MySQLdb.Error:
+                    self.discard(conn)
+                    continue
+            return conn
+        
+        conn = MySQLdb.connect(**self.connect_args)
+        with self.lock:
+            self.created += 1
+        return conn
+
+    def checkin(self, conn, broken):
+        with self.lock:
+            self.in_use -= 1
+        
+        if (not broken):
+            try:
+                # end any open transaction so that the next user sees a fresh snapshot
+                conn.rollback()
+            except MySQLdb.Error:
+                broken = True
+        
+        if (broken):
+            self.discard(conn)
+        else:
+            with self.lock:
+                self.idle.append((conn, time.monotonic()))
+
+    def discard(self, conn):
+        with self.lock:
+            self.discarded += 1
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "created": self.created,
+                "discarded": self.discarded,
+                "wait_ms_avg": round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 3)
+            }
+
+class TTLCache:
+
+    def __init__(self, maxsize, ttl, shared_generation=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        
+        # key -> (value, expires_at), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        
+        # counter in shared memory bumped by invalidate() in any pre-forked worker;
+        # a worker that sees it change drops all of its entries
+        self.shared_generation = shared_generation
+        self.seen_generation = shared_generation.value if shared_generation is not None else 0
+        
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self):
+        if (self.shared_generation is None):
+            return 0
+        return self.shared_generation.value
+
+    def sync(self):
+        # must be called with self.lock held
+        current = self.generation()
+        if (current != self.seen_generation):
+            self.entries.clear()
+            self.seen_generation = current
+
+    def get(self, key):
+        with self.lock:
+            self.sync()
+            entry = self.entries.get(key)
+            if (entry is None):
+                self.misses += 1
+                return None
+            
+            value, expires_at = entry
+            if (expires_at <= time.monotonic()):
+                del self.entries[key]
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None, generation=None):
+        # generation: value of generation() taken before the value was loaded; the value is
+        # dropped if the cache was invalidated in the meantime
+        if (self.maxsize <= 0):
+            return
+        
+        if (ttl is None):
+            ttl = self.ttl
+        
+        with self.lock:
+            self.sync()
+            if (generation is not None and generation != self.seen_generation):
+                return
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while (len(self.entries) > self.maxsize):
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            self.sync()
+            if (self.shared_generation is not None):
+                # other workers cannot drop a single key, so they drop everything
+                with self.shared_generation.get_lock():
+                    self.shared_generation.value += 1
+                    self.seen_generation = self.shared_generation.value
+            
+            if (key is None):
+                num = len(self.entries)
+                self.entries.clear()
+                return num
+            elif (self.entries.pop(key, None) is not None):
+                return 1
+            else:
+                return 0
+
+    def stats(self):
+        with self.lock:
+            self.sync()
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+def escape_label(value):
+    # label values in the text exposition format escape backslash, double quote and line feed
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+
+    # histogram bucket upper bounds in milliseconds
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        
+        # phase -> [bucket counts (last one is +Inf), sum, count]
+        self.histograms = {}
+        # (name, labels) -> value
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, phase, elapsed_ms):
+        i = bisect.bisect_left(self.BUCKETS_MS, elapsed_ms)
+        with self.lock:
+            histogram = self.histograms.get(phase)
+            if (histogram is None):
+                histogram = [[0] * (len(self.BUCKETS_MS) + 1), 0.0, 0]
+                self.histograms[phase] = histogram
+            histogram[0][i] += 1
+            histogram[1] += elapsed_ms
+            histogram[2] += 1
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, (time.perf_counter() - start) * 1000)
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add(self, name, labels, value):
+        key = (name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def snapshot(self):
+        # JSON-serializable copy of the collected values (see merge())
+        with self.lock:
+            return {
+                "histograms": {phase: [list(v[0]), v[1], v[2]] for phase, v in self.histograms.items()},
+                "counters": [[name, [list(l) for l in labels], value] for (name, labels), value in self.counters.items()],
+                "gauges": [[name, [list(l) for l in labels], value] for (name, labels), value in self.gauges.items()]
+            }
+
+    @staticmethod
+    def merge(snapshots):
+        # sum the snapshots of several workers into (histograms, counters, gauges)
+        histograms = {}
+        counters = {}
+        gauges = {}
+        for snapshot in snapshots:
+            for phase, (buckets, total, count) in snapshot["histograms"].items():
+                histogram = histograms.setdefault(phase, [[0] * len(buckets), 0.0, 0])
+                histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+                histogram[1] += total
+                histogram[2] += count
+            for kind, merged in (("counters", counters), ("gauges", gauges)):
+                for name, labels, value in snapshot[kind]:
+                    key = (name, tuple(tuple(l) for l in labels))
+                    merged[key] = merged.get(key, 0) + value
+        return histograms, counters, gauges
+
+    def render(self, snapshots, extra_gauges):
+        # Prometheus text exposition format
+        def fmt_labels(labels):
+            if (not labels):
+                return ""
+            return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels) + "}"
+        
+        histograms, counters, gauges = self.merge(snapshots)
+        gauges.update(extra_gauges)
+        
+        lines = ["# TYPE provider_phase_duration_ms histogram"]
+        for phase, (buckets, total, count) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, num in zip(self.BUCKETS_MS + ("+Inf",), buckets):
+                cumulative += num
+                lines.append(f"provider_phase_duration_ms_bucket{fmt_labels((('phase', phase), ('le', bound)))} {cumulative}")
+            lines.append(f"provider_phase_duration_ms_sum{fmt_labels((('phase', phase),))} {total:.3f}")
+            lines.append(f"provider_phase_duration_ms_count{fmt_labels((('phase', phase),))} {count}")
+        
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted(set(name for name, _ in values)):
+                lines.append(f"# TYPE {name} {kind}")
+                for (n, labels), value in sorted(values.items()):
+                    if (n == name):
+                        lines.append(f"{name}{fmt_labels(labels)} {value}")
+        
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+db_pool = DBConnectionPool(DB_POOL_SIZE, DB_POOL_IDLE_TIMEOUT, DB_POOL_PING_INTERVAL, DB_POOL_CHECKOUT_TIMEOUT,
+    user=DBUSER, passwd=DBUSERPASS, host=DBHOST, port=DBPORT, db=DBNAME)
+# allocated before the workers are forked so that an invalidation reaches all of them
+policy_cache = TTLCache(POLICY_CACHE_SIZE, POLICY_CACHE_TTL, multiprocessing.Value("L", 0))
+spec_cache = TTLCache(SPEC_CACHE_SIZE, SPEC_CACHE_TTL)
+registry_executor = ThreadPoolExecutor(max_workers=REGISTRY_WORKERS)
+registry_local = threading.local()
+registries_loaded = {"mtime": None, "registries": []}
+attestation_cache = TTLCache(ATTESTATION_CACHE_SIZE, ATTESTATION_REFRESH_INTERVAL)
+stats_caches = {"policy": policy_cache, "spec": spec_cache, "attestation": attestation_cache}
+trust_anchors = {}
+# key, certificate and their mtimes; replaced as a whole so that a request never mixes two versions
+signing_material = {}
+# reentrant because the SIGHUP handler may interrupt a reload in the main thread
+signing_material_lock = threading.RLock()
+
 app = Flask(__name__)
 api = Api(app, version='1.0', title='Data Providing Server', description="API for application")
 
 def gen_certificate_request():
-    subprocess.run(["openssl", "req", "-nodes", "-new", "-keyout", "files/private.key", "-out", "files/provider.csr", "-outform", "DER", "-subj", "/C=JP/CN=" + os.environ["HOST_NAME"]])
+    subprocess.run(["openssl", "req", "-nodes", "-new", "-keyout", SIGNING_KEY, "-out", "files/provider.csr", "-outform", "DER", "-subj", "/C=JP/CN=" + os.environ["HOST_NAME"]])
 
 def get_server_cert():
     gen_certificate_request()
@@ -133,11 +531,144 @@ def get_server_cert():
 
     res = requests.post(url="http://" + PRIVATE_CA + "/issue", data=csr, params={"san": os.environ["HOST_NAME"]}, headers={"Context-Type": "application/octet-stream"})
 
-    cert_filename = "files/server.pem"
+    cert_filename = SERVER_CERT
 
     with open(cert_filename, "w") as f:
         f.write(res.text)
 
+class WrappedDataFile(io.RawIOBase):
+    
+    # read-only, seekable view of prefix + stored data file + suffix
+    def __init__(self, file_path, prefix, suffix):
+        self.f = open(file_path, "rb")
+        self.prefix = prefix
+        self.suffix = suffix
+        self.data_size = os.fstat(self.f.fileno()).st_size
+        self.length = len(prefix) + self.data_size + len(suffix)
+        self.pos = 0
+        self.read_ms = 0.0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if (whence == io.SEEK_CUR):
+            offset += self.pos
+        elif (whence == io.SEEK_END):
+            offset += self.length
+        self.pos = max(0, offset)
+        return self.pos
+
+    def readinto(self, b):
+        n = 0
+        data_end = len(self.prefix) + self.data_size
+        while (n < len(b) and self.pos < self.length):
+            want = len(b) - n
+            if (self.pos < len(self.prefix)):
+                chunk = self.prefix[self.pos:self.pos + want]
+            elif (self.pos < data_end):
+                start = time.perf_counter()
+                self.f.seek(self.pos - len(self.prefix))
+                chunk = self.f.read(min(want, data_end - self.pos))
+                self.read_ms += (time.perf_counter() - start) * 1000
+                if (not chunk):
+                    break
+            else:
+                chunk = self.suffix[self.pos - data_end:self.pos - data_end + want]
+            b[n:n + len(chunk)] = chunk
+            n += len(chunk)
+            self.pos += len(chunk)
+        return n
+
+    def close(self):
+        if (not self.closed):
+            metrics.observe("file_read", self.read_ms)
+        self.f.close()
+        super().close()
+
+def build_condition(res):
+    condition = {}
+    if (res[3] != None):
+        condition["counter"] = res[3]
+    else:
+        condition["counter"] = ""
+    
+    if (res[4] != None):
+        condition["location"] = res[4]
+    else:
+        condition["location"] = ""
+    
+    strtimefmt = "%Y-%m-%d"
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if (res[5] != None and res[6] != None):
+        if (today + timedelta(days=res[5]) < datetime.strptime(res[6], strtimefmt)):
+            condition["expirationDate"] = (today + timedelta(days=res[5])).strftime("%Y-%m-%d")
+        else:
+            condition["expirationDate"] = res[6]
+    else:
+        if (res[5] != None):
+            condition["expirationDate"] = (today + timedelta(days=res[5])).strftime("%Y-%m-%d")
+        if (res[6] != None):
+            condition["expirationDate"] = res[6]
+        else:
+            condition["expirationDate"] = ""
+    return condition
+
+def negotiate_encoding(length):
+    # small bodies gain little and the compressor costs CPU on every request
+    if (not DATA_COMPRESSION or length < DATA_COMPRESSION_MIN_BYTES):
+        return "identity"
+    encodings = ["gzip"]
+    if (zstandard is not None):
+        encodings.insert(0, "zstd")
+    return request.accept_encodings.best_match(encodings, default="identity")
+
+def compressed_chunks(wrapped, encoding):
+    try:
+        if (encoding == "zstd"):
+            compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        while True:
+            chunk = wrapped.read(DATA_CHUNK_SIZE)
+            if (not chunk):
+                break
+            out = compressor.compress(chunk)
+            if (out):
+                yield out
+        yield compressor.flush()
+    finally:
+        wrapped.close()
+
+def stream_data(file_path, condition):
+    # the stored file is already JSON, so it is sent as-is inside the envelope
+    prefix = ('{"condition": ' + json.dumps(condition) + ', "data": ').encode()
+    wrapped = WrappedDataFile(file_path, prefix, b"}")
+    
+    stat = os.fstat(wrapped.f.fileno())
+    etag = hashlib.sha1(prefix + f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()
+    
+    encoding = negotiate_encoding(wrapped.length)
+    if (encoding == "identity"):
+        response = Response(wrap_file(request.environ, wrapped, DATA_CHUNK_SIZE), mimetype="application/json", direct_passthrough=True)
+        response.content_length = wrapped.length
+        if (DATA_COMPRESSION and wrapped.length >= DATA_COMPRESSION_MIN_BYTES):
+            response.headers["Vary"] = "Accept-Encoding"
+        response.set_etag(etag, weak=True)
+        return response.make_conditional(request, accept_ranges=True, complete_length=wrapped.length)
+    
+    response = Response(compressed_chunks(wrapped, encoding), mimetype="application/json", direct_passthrough=True)
+    response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.set_etag(etag + "-" + encoding, weak=True)
+    return response.make_conditional(request)
+
 @app.route("/data/<data_type>/<data>")
 def provide_data(data_type, data):
     pem_cert = request.environ.get("SSL_CLIENT_CERT")
@@ -145,62 +676,141 @@ def provide_data(data_type, data):
 
     app_ID = get_MRENCLAVE(cert)
     
-    conn = MySQLdb.connect(user=DBUSER, passwd=DBUSERPASS, host="provider-db", port=DBPORT, db="provider")
-    cur = conn.cursor()
-    
-    query = "SELECT * FROM saved_policy WHERE app_id = '%s' && data_id = '%s'" % (app_ID, "https://" + HOST_NAME + ":" + os.environ["SERVER_PORT"] + "/data/" + data_type + "/" + data)
-    num = cur.execute(query)
+    data_ID = "https://" + HOST_NAME + ":" + os.environ["SERVER_PORT"] + "/data/" + data_type + "/" + data
+    with metrics.timed("saved_policy_lookup"), db_pool.connection() as conn:
+        cur = conn.cursor()
+        num = cur.execute(SELECT_SAVED_POLICY, (app_ID, data_id_hash(data_ID)))
+        res = cur.fetchone()
+        cur.close()
     
     if (num != 1):
-        cur.close()
-        conn.close()
-        msg =  f"Failed to load data usage policy (query:{query})"
+        msg =  f"Failed to load data usage policy (app_id:{app_ID}, data_id:{data_ID})"
         print(msg)
-        print(f"Error query: {query}")
         return msg, 400
     else:
-        res = cur.fetchone()
-        cur.close()
-        conn.close()
-        
         ret = {}
         try:
-            with open(data_file_path + "/" + data_type + "/" + data + ".json", "r") as f:
-                ret["data"] = json.load(f)
-            
-            ret["condition"] = {}
-            if (res[3] != None):
-                ret["condition"]["counter"] = res[3]
-            else:
-                ret["condition"]["counter"] = ""
+            file_path = data_file_path + "/" + data_type + "/" + data + ".json"
+            if (DATA_DELIVERY_MODE == "buffered"):
+                with metrics.timed("file_read"):
+                    with open(file_path, "r") as f:
+                        ret["data"] = json.load(f)
             
-            if (res[4] != None):
-                ret["condition"]["location"] = res[4]
-            else:
-                ret["condition"]["location"] = ""
-            
-            strtimefmt = "%Y-%m-%d"
-            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            if (res[5] != None and res[6] != None):
-                if (today + timedelta(days=res[5]) < datetime.strptime(res[6], strtimefmt)):
-                    ret["condition"]["expirationDate"] = (today + timedelta(days=res[5])).strftime("%Y-%m-%d")
-                else:
-                    ret["condition"]["expirationDate"] = res[6]
-            else:
-                if (res[5] != None):
-                    ret["condition"]["expirationDate"] = (today + timedelta(days=res[5])).strftime("%Y-%m-%d")
-                if (res[6] != None):
-                    ret["condition"]["expirationDate"] = res[6]
-                else:
-                    ret["condition"]["expirationDate"] = ""
+            ret["condition"] = build_condition(res)
             print("="*10 + "Condition" + "=" * 10)
             print(ret["condition"])
             print("="*38)
             
-            return jsonify(ret), 200
+            if (DATA_DELIVERY_MODE == "buffered"):
+                return jsonify(ret), 200
+            else:
+                return stream_data(file_path, ret["condition"])
         except Exception as e:
             return f"Failed to get requested data ({str(e)})", 500
 
+@app.before_request
+def metrics_before_request():
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule is not None else "unknown"
+    metrics.add("provider_requests_in_flight", (("endpoint", g.metrics_endpoint),), 1)
+
+@app.after_request
+def metrics_after_request(response):
+    metrics.inc("provider_requests_total", (("endpoint", g.get("metrics_endpoint", "unknown")), ("status", str(response.status_code))))
+    g.metrics_counted = True
+    return response
+
+@app.teardown_request
+def metrics_teardown_request(exc):
+    endpoint = g.get("metrics_endpoint")
+    if (endpoint is None):
+        return
+    metrics.add("provider_requests_in_flight", (("endpoint", endpoint),), -1)
+    # an unhandled exception that Flask turned into a 500 response was counted by after_request
+    if (exc is not None and not g.get("metrics_counted", False)):
+        metrics.inc("provider_requests_total", (("endpoint", endpoint), ("status", "exception")))
+
+def worker_snapshot():
+    return {
+        "metrics": metrics.snapshot(),
+        "db_pool": db_pool.stats(),
+        "caches": {name: cache.stats() for name, cache in stats_caches.items()}
+    }
+
+def snapshot_path(pid):
+    return os.path.join(METRICS_SNAPSHOT_DIR, f"{pid}.json")
+
+def publish_snapshots():
+    path = snapshot_path(os.getpid())
+    while True:
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(worker_snapshot(), f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Failed to write metrics snapshot ({str(e)})")
+        time.sleep(METRICS_SNAPSHOT_INTERVAL)
+
+def collect_snapshots():
+    # the own values are current, those of the other workers up to METRICS_SNAPSHOT_INTERVAL old
+    snapshots = [worker_snapshot()]
+    if (SERVER_MODE != "production"):
+        return snapshots
+    
+    own = os.path.basename(snapshot_path(os.getpid()))
+    for name in os.listdir(METRICS_SNAPSHOT_DIR):
+        if (not name.endswith(".json") or name == own):
+            continue
+        try:
+            with open(os.path.join(METRICS_SNAPSHOT_DIR, name), "r") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # the worker exited and its snapshot was removed
+            continue
+    return snapshots
+
+def merge_stats(stats):
+    # counts and sizes add up across workers; the TTL is the same in all of them
+    merged = {}
+    for key in stats[0]:
+        values = [s[key] for s in stats]
+        if (key == "ttl"):
+            merged[key] = values[0]
+        elif (key == "wait_ms_max"):
+            merged[key] = max(values)
+        elif (key == "wait_ms_avg"):
+            checkouts = sum(s["checkouts"] for s in stats)
+            merged[key] = round(sum(s[key] * s["checkouts"] for s in stats) / checkouts, 3) if checkouts else 0.0
+        else:
+            merged[key] = sum(values)
+    return merged
+
+@app.route("/metrics")
+def provider_metrics():
+    snapshots = collect_snapshots()
+    extra_gauges = {("provider_workers", ()): len(snapshots)}
+    for name, value in merge_stats([s["db_pool"] for s in snapshots]).items():
+        extra_gauges[("provider_db_pool_" + name, ())] = value
+    for cache_name in stats_caches:
+        for name, value in merge_stats([s["caches"][cache_name] for s in snapshots]).items():
+            extra_gauges[("provider_cache_" + name, (("cache", cache_name),))] = value
+    return Response(metrics.render([s["metrics"] for s in snapshots], extra_gauges), mimetype="text/plain; version=0.0.4")
+
+@app.route("/stats/db-pool")
+def db_pool_stats():
+    return jsonify(merge_stats([s["db_pool"] for s in collect_snapshots()])), 200
+
+@app.route("/stats/policy-cache")
+def policy_cache_stats():
+    return jsonify(merge_stats([s["caches"]["policy"] for s in collect_snapshots()])), 200
+
+@app.route("/stats/spec-cache")
+def spec_cache_stats():
+    return jsonify(merge_stats([s["caches"]["spec"] for s in collect_snapshots()])), 200
+
+@app.route("/stats/attestation-cache")
+def attestation_cache_stats():
+    return jsonify(merge_stats([s["caches"]["attestation"] for s in collect_snapshots()])), 200
+
 app_res_doc = {
     200: "Success",
     400: "Failed (Invalid request)",
@@ -218,6 +828,149 @@ app_body_doc = api.model("application body", {
     "signature": fields.String(description="signature", required=True)
 })
 
+class ApplicationError(Exception):
+
+    def __init__(self, description, status=400):
+        super().__init__(description)
+        self.description = description
+        self.status = status
+
+def decide_saved_policy(usage_declaration, subject, processing_spec, providing_policy):
+    
+    # determine whether or not to provide data
+    args = []
+    for data_type in processing_spec.input:
+        if (providing_policy.type == data_type.split("_")[0]):
+            args.append(data_type)
+    if (not args):
+        raise ApplicationError("Failed to apply due to input constraints")
+    
+    if (subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value != usage_declaration.consumer):
+        raise ApplicationError("Failed to apply (certificate and declaration information does not match)")
+    
+    if (subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value not in providing_policy.consumer):
+        raise ApplicationError("Failed to apply (not allowed to provide for this consumer)")
+    
+    if (usage_declaration.app_ID not in providing_policy.app_ID):
+        raise ApplicationError("Failed to apply (Not Allowed to provide for this application)")
+    
+    try:
+        for output in processing_spec.output:
+            if (len(output) == 0):
+                break
+            
+            if (output not in [disc.split(".")[0] + "_" + str(usage_declaration.arg_num) + "." + disc.split(".")[1] for disc in providing_policy.disclosing]):
+                raise ApplicationError("Failed to apply (not allowed to disclose)")
+    except IndexError:
+        raise ApplicationError("Failed to apply (invalid index)")
+    
+    # Access Counter
+    if (providing_policy.counter != 0 and usage_declaration.counter != 0):
+        if (providing_policy.counter < usage_declaration.counter):
+            raise ApplicationError("Failed to apply (exceeded number of accesses allowed)")
+        
+        else:
+            saved_counter = usage_declaration.counter
+    
+    elif (providing_policy.counter != None):
+        saved_counter = providing_policy.counter
+    
+    elif (usage_declaration.counter != None):
+        saved_counter = usage_declaration.counter
+    
+    else:
+        saved_counter = None
+
+    # Location
+    if (providing_policy.location != None and usage_declaration.location != None):
+        if (providing_policy.location != usage_declaration.location):
+            raise ApplicationError("Failed to apply (Locations where access is not permitted)")
+
+        else:
+            saved_location = usage_declaration.location
+
+    elif (providing_policy.location != None):
+        saved_location = providing_policy.location
+
+    elif (usage_declaration.location != None):
+        saved_location = usage_declaration.location
+    
+    else:
+        saved_location = None
+
+    
+    # Duration
+    if (providing_policy.duration != 0 and usage_declaration.duration != 0):
+        if (providing_policy.duration < usage_declaration.duration):
+            raise ApplicationError("Failed to apply (exceeded access duration)")
+
+        else:
+            saved_duration = usage_declaration.duration
+
+    elif (providing_policy.duration != None):
+        saved_duration = providing_policy.duration
+
+    elif (usage_declaration.duration != None):
+        saved_duration = usage_declaration.duration
+    
+    else:
+        saved_duration = None
+    
+    
+    strtimefmt = "%Y-%m-%d"
+    
+    # Expiration Date
+    if (providing_policy.expiration_date != None and usage_declaration.expiration_date != None):
+        pp_date = datetime.strptime(providing_policy.expiration_date, strtimefmt)
+        ud_date = datetime.strptime(usage_declaration.expiration_date, strtimefmt)
+        if (pp_date < ud_date):
+            raise ApplicationError("Failed to apply (exceeding the date of available)")
+
+        else:
+            saved_expiration_date = usage_declaration.expiration_date
+
+    elif (providing_policy.expiration_date != None):
+        saved_expiration_date = providing_policy.expiration_date
+
+    elif (usage_declaration != None):
+        saved_expiration_date = usage_declaration.expiration_date
+    
+    else:
+        saved_expiration_date = None
+    
+    return saved_counter, saved_location, saved_duration, saved_expiration_date
+
+def issue_token(usage_declaration, saved_counter, saved_location, saved_duration, saved_expiration_date):
+    payload = {
+        "status": "completed",
+        "consumer": usage_declaration.consumer,
+        "app_ID": usage_declaration.app_ID,
+        "data_ID": usage_declaration.data_ID,
+        "arg_num": usage_declaration.arg_num,
+        "counter": saved_counter,
+        "location": saved_location,
+        "duration": saved_duration,
+        "expiration_date": saved_expiration_date
+    }
+    
+    material = get_signing_material()
+    with metrics.timed("jwt_signing"):
+        jwt_assertion = jwt.encode(payload, material["key"], algorithm="RS512")
+    return jwt_assertion, material["cert"]
+
+def timed_processing_spec(app_ID):
+    print(f"Start processing spec retrieval (app_id:{app_ID})")
+    start = datetime.now()
+    with metrics.timed("spec_retrieval"):
+        processing_spec = get_processing_spec(app_ID)
+    if (processing_spec is None):
+        return None
+    end = datetime.now()
+    print(f"Finish processing spec retrieval")
+    elapsed_ms = round((end - start).total_seconds() * 1000)
+    print(f"___BENCH___ Processing spec retrieval (Start:{start.strftime('%Y-%m-%d %H:%M:%S')}, End:{end.strftime('%Y-%m-%d %H:%M:%S')}, Duration_ms:{elapsed_ms})")
+    return processing_spec
+
 @api.route("/apply")
 class apply(Resource):
     @api.doc(body=app_body_doc)
@@ -238,18 +991,12 @@ class apply(Resource):
         subject = cert.subject
         
         # obtain the data processing spec
-        print(f"Start processing spec retrieval (app_id:{usage_declaration.app_ID})")
-        start = datetime.now()
-        processing_spec = get_processing_spec(usage_declaration.app_ID)
+        processing_spec = timed_processing_spec(usage_declaration.app_ID)
         if (processing_spec is None):
             return make_response(jsonify({
                         "status": "failed",
                         "description": "Failed to get data processing specification"
                     }), 400)
-        end = datetime.now()
-        print(f"Finish processing spec retrieval")
-        elapsed_ms = round((end - start).total_seconds() * 1000)
-        print(f"___BENCH___ Processing spec retrieval (Start:{start.strftime('%Y-%m-%d %H:%M:%S')}, End:{end.strftime('%Y-%m-%d %H:%M:%S')}, Duration_ms:{elapsed_ms})")
         
         # obtain the data providing policy
         providing_policy = get_providing_policy(usage_declaration.data_ID)
@@ -259,183 +1006,250 @@ class apply(Resource):
                         "description": f"Failed to get data providing policy (data_id:{usage_declaration.data_ID})"
                     }), 400)
         
-        # determine whether or not to provide data
-        args = []
-        for data_type in processing_spec.input:
-            if (providing_policy.type == data_type.split("_")[0]):
-                args.append(data_type)
-        if (not args):
+        try:
+            saved_counter, saved_location, saved_duration, saved_expiration_date = decide_saved_policy(usage_declaration, subject, processing_spec, providing_policy)
+        except ApplicationError as e:
             return make_response(jsonify({
                         "status": "failed",
-                        "description": "Failed to apply due to input constraints"
-                    }), 400)
-        
-        if (subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value != usage_declaration.consumer):
+                        "description": e.description
+                    }), e.status)
+
+        # Save the usage declaration
+        with metrics.timed("db_insert"), db_pool.connection() as conn:
+            cur = conn.cursor()
+            num = cur.execute(INSERT_SAVED_POLICY, (usage_declaration.consumer, usage_declaration.app_ID, usage_declaration.data_ID, saved_counter, saved_location, saved_duration, saved_expiration_date))
+            conn.commit()
+            cur.close()
+
+        if (num != 1):
+            
             return make_response(jsonify({
                         "status": "failed",
-                        "description": "Failed to apply (certificate and declaration information does not match)"
-                    }), 400)
+                        "description": "Failed to store declaration"
+                    }), 500)
         
-        if (subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value not in providing_policy.consumer):
-            return make_response(jsonify({
-                        "status": "failed",
-                        "description": "Failed to apply (not allowed to provide for this consumer)"
-                    }), 400)
+        jwt_assertion, server_cert = issue_token(usage_declaration, saved_counter, saved_location, saved_duration, saved_expiration_date)
         
-        if (usage_declaration.app_ID not in providing_policy.app_ID):
-            return make_response(jsonify({
-                        "status": "failed",
-                        "description": "Failed to apply (Not Allowed to provide for this application)"
-                    }), 400)
+        ret = {
+            "status": "completed",
+            "jwt": jwt_assertion,
+            "cert": server_cert
+        }
+    
+        return make_response(jsonify(ret), 200)
+
+batch_body_doc = api.model("batch application body", {
+    "declarations": fields.List(fields.Nested(app_body_doc), description="Signed data usage declarations", required=True)
+})
+
+@api.route("/apply/batch")
+class apply_batch(Resource):
+    @api.doc(body=batch_body_doc)
+    @api.doc(responses=app_res_doc)
+    def post(self):
+        pem_cert = request.environ.get("SSL_CLIENT_CERT")
+        cert = x509.load_pem_x509_certificate(pem_cert.encode(), default_backend())
+        subject = cert.subject
         
-        try:
-            for output in processing_spec.output:
-                if (len(output) == 0):
-                    break
-                
-                if (output not in [disc.split(".")[0] + "_" + str(usage_declaration.arg_num) + "." + disc.split(".")[1] for disc in providing_policy.disclosing]):
-                    return make_response(jsonify({
-                                "status": "failed",
-                                "description": "Failed to apply (not allowed to disclose)"
-                            }), 400)
-        except IndexError:
+        body = request.get_json(silent=True) or {}
+        declarations = body.get("declarations")
+        if (not isinstance(declarations, list) or not declarations or len(declarations) > APPLY_BATCH_MAX):
             return make_response(jsonify({
                         "status": "failed",
-                        "description": "Failed to apply (invalid index)"
+                        "description": f"Failed to apply (declarations must be a list of 1 to {APPLY_BATCH_MAX} items)"
                     }), 400)
         
-        # Access Counter
-        if (providing_policy.counter != 0 and usage_declaration.counter != 0):
-            if (providing_policy.counter < usage_declaration.counter):
-                return make_response(jsonify({
-                            "status": "failed",
-                            "description": "Failed to apply (exceeded number of accesses allowed)"
-                        }), 400)
-            
-            else:
-                saved_counter = usage_declaration.counter
+        # per-item result, filled in as each item fails or succeeds
+        results = [None] * len(declarations)
+        usage_declarations = {}
+        for i, item in enumerate(declarations):
+            try:
+                usage_declarations[i] = DataUsageDeclaration(item, cert)
+            except RuntimeError:
+                results[i] = {"status": "failed", "description": "Failed to verify data usage declaration's signature"}
+            except (KeyError, TypeError, AttributeError, ValueError):
+                # ValueError includes binascii.Error (signature is not base64) and non-numeric counter/duration
+                results[i] = {"status": "failed", "description": "Malformed data usage declaration"}
         
-        elif (providing_policy.counter != None):
-            saved_counter = providing_policy.counter
+        # obtain each distinct data processing spec once
+        processing_specs = {}
+        for usage_declaration in usage_declarations.values():
+            if (usage_declaration.app_ID not in processing_specs):
+                processing_specs[usage_declaration.app_ID] = timed_processing_spec(usage_declaration.app_ID)
         
-        elif (usage_declaration.counter != None):
-            saved_counter = usage_declaration.counter
+        # obtain all data providing policies in one query
+        providing_policies = get_providing_policies([d.data_ID for d in usage_declarations.values()])
         
-        else:
-            saved_counter = None
-
-        # Location
-        if (providing_policy.location != None and usage_declaration.location != None):
-            if (providing_policy.location != usage_declaration.location):
-                return make_response(jsonify({
-                            "status": "failed",
-                            "description": "Failed to apply (Locations where access is not permitted)"
-                        }), 400)
-
-            else:
-                saved_location = usage_declaration.location
-
-        elif (providing_policy.location != None):
-            saved_location = providing_policy.location
-
-        elif (usage_declaration.location != None):
-            saved_location = usage_declaration.location
+        rows = {}
+        for i, usage_declaration in usage_declarations.items():
+            processing_spec = processing_specs[usage_declaration.app_ID]
+            if (processing_spec is None):
+                results[i] = {"status": "failed", "description": "Failed to get data processing specification"}
+                continue
+            
+            providing_policy = providing_policies.get(usage_declaration.data_ID)
+            if (providing_policy is None):
+                results[i] = {"status": "failed", "description": f"Failed to get data providing policy (data_id:{usage_declaration.data_ID})"}
+                continue
+            
+            try:
+                rows[i] = decide_saved_policy(usage_declaration, subject, processing_spec, providing_policy)
+            except ApplicationError as e:
+                results[i] = {"status": "failed", "description": e.description}
         
-        else:
-            saved_location = None
-
+        # save all accepted usage declarations in one transaction
+        stored = save_policies({i: (usage_declarations[i],) + saved for i, saved in rows.items()})
+        
+        server_cert = None
+        for i, saved in rows.items():
+            if (not stored[i]):
+                results[i] = {"status": "failed", "description": "Failed to store declaration"}
+                continue
+            jwt_assertion, server_cert = issue_token(usage_declarations[i], *saved)
+            results[i] = {"status": "completed", "jwt": jwt_assertion}
+        
+        num_completed = sum(1 for result in results if result["status"] == "completed")
+        if (num_completed == 0):
+            return make_response(jsonify({
+                        "status": "failed",
+                        "description": "Failed to apply (no declaration was accepted)",
+                        "results": results
+                    }), 400)
         
-        # Duration
-        if (providing_policy.duration != 0 and usage_declaration.duration != 0):
-            if (providing_policy.duration < usage_declaration.duration):
-                return make_response(jsonify({
-                            "status": "failed",
-                            "description": "Failed to apply (exceeded access duration)"
-                        }), 400)
+        return make_response(jsonify({
+                    "status": "completed" if num_completed == len(results) else "partial",
+                    "cert": server_cert,
+                    "results": results
+                }), 200)
 
-            else:
-                saved_duration = usage_declaration.duration
+invalidate_body_doc = api.model("policy invalidation body", {
+    "data_ID": fields.String(description="Data identifier (URL) whose cached policy is dropped; all entries if omitted (admins only)", required=False)
+})
 
-        elif (providing_policy.duration != None):
-            saved_duration = providing_policy.duration
+def may_invalidate_policy(subject, data_ID):
+    # admins may drop any entry; the data provider named in the policy only its own
+    if (subject in POLICY_ADMINS):
+        return True
+    if (data_ID is None):
+        return False
+    
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(SELECT_POLICY_PROVIDERS, (data_id_hash(data_ID),))
+        providers = [row[0] for row in cur.fetchall()]
+        cur.close()
+    return bool(providers) and all(provider == subject for provider in providers)
 
-        elif (usage_declaration.duration != None):
-            saved_duration = usage_declaration.duration
-        
-        else:
-            saved_duration = None
+@api.route("/policy/invalidate")
+class invalidate_policy(Resource):
+    @api.doc(body=invalidate_body_doc)
+    @api.doc(responses={200: "Success", 403: "Failed (Not the data provider or an admin)"})
+    def post(self):
+        pem_cert = request.environ.get("SSL_CLIENT_CERT")
+        cert = x509.load_pem_x509_certificate(pem_cert.encode(), default_backend())
+        subject = cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value
         
+        body = request.get_json(silent=True) or {}
+        data_ID = body.get("data_ID") if isinstance(body, dict) else None
+        if (not isinstance(body, dict) or (data_ID is not None and not isinstance(data_ID, str))):
+            return make_response(jsonify({
+                        "status": "failed",
+                        "description": "Failed to invalidate (body must be an object whose data_ID is a string)"
+                    }), 400)
         
-        strtimefmt = "%Y-%m-%d"
+        if (not may_invalidate_policy(subject, data_ID)):
+            return make_response(jsonify({
+                        "status": "failed",
+                        "description": "Not allowed to invalidate this policy"
+                    }), 403)
         
-        # Expiration Date
-        if (providing_policy.expiration_date != None and usage_declaration.expiration_date != None):
-            pp_date = datetime.strptime(providing_policy.expiration_date, strtimefmt)
-            ud_date = datetime.strptime(usage_declaration.expiration_date, strtimefmt)
-            if (pp_date < ud_date):
-                return make_response(jsonify({
-                            "status": "failed",
-                            "description": "Failed to apply (exceeding the date of available)"
-                        }), 400)
+        num = policy_cache.invalidate(data_ID)
+        return make_response(jsonify({
+                    "status": "completed",
+                    "invalidated": num
+                }), 200)
 
-            else:
-                saved_expiration_date = usage_declaration.expiration_date
 
-        elif (providing_policy.expiration_date != None):
-            saved_expiration_date = providing_policy.expiration_date
+def signing_material_mtime():
+    try:
+        return (os.stat(SIGNING_KEY).st_mtime, os.stat(SERVER_CERT).st_mtime)
+    except OSError:
+        return None
 
-        elif (usage_declaration != None):
-            saved_expiration_date = usage_declaration.expiration_date
+def load_signing_material():
+    global signing_material
+    with signing_material_lock:
+        # take the timestamps first so that a rotation during loading triggers another reload
+        mtime = signing_material_mtime()
         
-        else:
-            saved_expiration_date = None
-
-        # Save the usage declaration
-        conn = MySQLdb.connect(user=DBUSER, passwd=DBUSERPASS, host="provider-db", port=DBPORT, db="provider")
-        cur = conn.cursor()
+        with open(SIGNING_KEY, "rb") as f:
+            key = serialization.load_pem_private_key(f.read(), password=None, backend=default_backend())
+        with open(SERVER_CERT, "r") as f:
+            cert = f.read()
         
-        query = "INSERT INTO saved_policy(consumer_subject, app_id, data_id, data_counter, data_location, data_duration, data_expiration_date)VALUES('%s', '%s', '%s', '%s', '%s', '%s', '%s')" % (usage_declaration.consumer, usage_declaration.app_ID, usage_declaration.data_ID, saved_counter, saved_location, saved_duration, saved_expiration_date)
-        num = cur.execute(query)
+        signing_material = {"key": key, "cert": cert, "mtime": mtime}
 
-        conn.commit()
-        cur.close()
-        conn.close()
+def get_signing_material():
+    # reload after get_server_cert rotates the key and certificate
+    material = signing_material
+    if (material.get("mtime") != signing_material_mtime()):
+        with signing_material_lock:
+            # another thread may have reloaded while this one waited
+            if (signing_material.get("mtime") != signing_material_mtime()):
+                load_signing_material()
+            material = signing_material
+    return material
 
-        if (num != 1):
-            
-            return make_response(jsonify({
-                        "status": "failed",
-                        "description": "Failed to store declaration"
-                    }), 500)
-        
-        payload = {
-            "status": "completed",
-            "consumer": usage_declaration.consumer,
-            "app_ID": usage_declaration.app_ID,
-            "data_ID": usage_declaration.data_ID,
-            "arg_num": usage_declaration.arg_num,
-            "counter": saved_counter,
-            "location": saved_location,
-            "duration": saved_duration,
-            "expiration_date": saved_expiration_date
-        }
-        
-        with open("files/private.key", "r") as f:
-            jwt_assertion = jwt.encode(payload, f.read(), algorithm="RS512")
-        
-        with open("files/server.pem", "r") as f:
-            ret = {
-                "status": "completed",
-                "jwt": jwt_assertion,
-                "cert": f.read()
-            }
+def reload_signing_material(signum, frame):
+    print("Reloading signing key and certificate")
+    load_signing_material()
+
+def load_trust_anchors():
+    # load IAS root CA certificate
+    with open(IAS_ROOTCA_CERT, "rb") as f:
+        root_cert = load_certificate(OpenSSL.crypto.FILETYPE_PEM, f.read())
+    store = X509Store()
+    store.add_cert(root_cert)
     
-        return make_response(jsonify(ret), 200)
+    with open(ISV_STATUS_VALUE_FILE, "r") as f:
+        isvEnclaveQuoteStatusValue = json.load(f)
+    
+    trust_anchors["store"] = store
+    trust_anchors["isvEnclaveQuoteStatusValue"] = isvEnclaveQuoteStatusValue
 
+def get_trust_anchors():
+    if (not trust_anchors):
+        load_trust_anchors()
+    return trust_anchors
 
 def verify(self, ssl_sock, client_address):
-    der_cert = ssl_sock.getpeercert(True)
+    result = "error"
+    start = time.perf_counter()
+    try:
+        result = check_client_certificate(ssl_sock.getpeercert(True))
+    finally:
+        metrics.observe("tls_verify", (time.perf_counter() - start) * 1000)
+        metrics.inc("provider_tls_verify_total", (("result", result),))
+    return result != "rejected"
+
+def check_client_certificate(der_cert):
+    # skip the attestation check for certificates verified recently
+    fingerprint = hashlib.sha256(der_cert).hexdigest()
+    if (attestation_cache.get(fingerprint) is not None):
+        return "cached"
+    
     cert = x509.load_der_x509_certificate(der_cert, default_backend())
+    if (not verify_attestation(cert)):
+        return "rejected"
+    
+    # do not keep an entry beyond the certificate's expiry
+    ttl = min(ATTESTATION_REFRESH_INTERVAL, (cert.not_valid_after - datetime.utcnow()).total_seconds())
+    if (ttl > 0):
+        attestation_cache.put(fingerprint, True, ttl)
+    return "verified"
+
+def verify_attestation(cert):
+    anchors = get_trust_anchors()
 
     for ext in cert.extensions:
         if (ext.value.oid.dotted_string == "1.2.3.4"):
@@ -444,16 +1258,9 @@ def verify(self, ssl_sock, client_address):
             certs = urllib.parse.unquote(header["x-iasreport-signing-certificate"])
             report_signing_cert_pem = certs.split("-----END CERTIFICATE-----")[0] + "-----END CERTIFICATE-----\n"
 
-            # load IAS root CA certificate
-            with open(IAS_ROOTCA_CERT, "rb") as f:
-                root_cert_pem = f.read()
-            
             # verify a certificate chain
-            root_cert = load_certificate(OpenSSL.crypto.FILETYPE_PEM, root_cert_pem)
             report_signing_cert = load_certificate(OpenSSL.crypto.FILETYPE_PEM, report_signing_cert_pem)
-            store = X509Store()
-            store.add_cert(root_cert)
-            store_ctx = X509StoreContext(store, report_signing_cert)
+            store_ctx = X509StoreContext(anchors["store"], report_signing_cert)
             try:
                 store_ctx.verify_certificate()
             except Exception as e:
@@ -476,8 +1283,7 @@ def verify(self, ssl_sock, client_address):
                 print("Signature verification of IAS report failed.")
                 return False
             
-            with open(ISV_STATUS_VALUE_FILE, "r") as f:
-                isvEnclaveQuoteStatusValue = json.load(f)
+            isvEnclaveQuoteStatusValue = anchors["isvEnclaveQuoteStatusValue"]
 
             print("=" * 119)
             print("Report Data\n")
@@ -523,50 +1329,73 @@ def verify(self, ssl_sock, client_address):
         return True
     return False
 
+def get_registries():
+    # reload the registry list only when the file has been modified
+    mtime = os.stat(REGISTRIES_API).st_mtime
+    if (registries_loaded["mtime"] != mtime):
+        with open(REGISTRIES_API, "r") as f:
+            registries_loaded["registries"] = f.read().split("\n")[:-1]
+        registries_loaded["mtime"] = mtime
+    return registries_loaded["registries"]
+
+def query_registry(registry, params):
+    # one keep-alive session per worker thread
+    session = getattr(registry_local, "session", None)
+    if (session is None):
+        session = requests.Session()
+        registry_local.session = session
+    
+    res = json.loads(session.get(registry, params=params, timeout=REGISTRY_TIMEOUT).text)
+    
+    if (res["Input"] != None):
+        res_input = res["Input"].split(", ")
+    else:
+        res_input = []
+        
+    if (res["Output"] != None):
+        res_output = res["Output"].split(", ")
+    else:
+        res_output = []
+    
+    return res_input, res_output
+
 def get_processing_spec(MRENCLAVE):
+    policy = spec_cache.get(MRENCLAVE)
+    if (policy is not None):
+        return policy
+    
     params = {"MRENCLAVE": MRENCLAVE}
+    registries = get_registries()
+    if (not registries):
+        print("No registry is configured")
+        return None
     
-    with open(REGISTRIES_API, "r") as f:
-        registries = f.read().split("\n")[:-1]
-
-    for registry in registries:
-        res = json.loads(requests.get(registry, params=params).text)
-        try:
-            if ("policy" not in locals()):
-
-                if (res["Input"] != None):
-                    res_input = res["Input"].split(", ")
-                else:
-                    res_input = []
-                    
-                if (res["Output"] != None):
-                    res_output = res["Output"].split(", ")
-                else:
-                    res_output = []
-                
+    # query all registries at once and stop at the first disagreement
+    futures = [registry_executor.submit(query_registry, registry, params) for registry in registries]
+    policy = None
+    try:
+        for future in as_completed(futures):
+            res_input, res_output = future.result()
+            if (policy is None):
                 policy = DataProcessingSpecification(MRENCLAVE, res_input, res_output)
-            else:
-                
-                if (res["Input"] != None):
-                    res_input = res["Input"].split(", ")
-                else:
-                    res_input = []
-                    
-                if (res["Output"] != None):
-                    res_output = res["Output"].split(", ")
-                else:
-                    res_output = []
-                
-                if (not policy.is_same(MRENCLAVE, res_input, res_output)):
-                    print("Verification Failed")
-                    return None
-        except Exception as e:
-            print("--- Exception!! ---")
-            print(e)
-            return None
+            elif (not policy.is_same(MRENCLAVE, res_input, res_output)):
+                print("Verification Failed")
+                return None
+    except Exception as e:
+        print("--- Exception!! ---")
+        print(e)
+        return None
+    finally:
+        for future in futures:
+            future.cancel()
     
+    spec_cache.put(MRENCLAVE, policy)
     return policy
 
+def data_id_hash(data_ID):
+    # must match policy.data_id_hash and saved_policy.data_id_hash (unhex(sha2(data_id, 256)))
+    return hashlib.sha256(data_ID.encode()).digest()
+
 def get_MRENCLAVE(cert):
     for ext in cert.extensions:
         if (ext.value.oid.dotted_string == "1.2.3.5"):
@@ -578,31 +1407,179 @@ def get_MRENCLAVE(cert):
 
 def get_providing_policy(data_ID):
     
-    conn = MySQLdb.connect(user=DBUSER, passwd=DBUSERPASS, host="provider-db", port=DBPORT, db="provider")
-    cur = conn.cursor()
+    policy = policy_cache.get(data_ID)
+    if (policy is not None):
+        return policy
     
-    query = "SELECT * FROM policy WHERE data_id = '%s'" % data_ID
-    num = cur.execute(query)
+    generation = policy_cache.generation()
+    with metrics.timed("policy_lookup"), db_pool.connection() as conn:
+        cur = conn.cursor()
+        num = cur.execute(SELECT_POLICY, (data_id_hash(data_ID),))
+        res = cur.fetchone()
+        cur.close()
 
     if (num != 1):
-        cur.close()
-        conn.close()
         return None
     else:
-        res = cur.fetchone()
+        policy = DataProvidingPolcy(res[0], res[1], res[2], res[3].split(", "), res[4], res[5].split(","), res[6], res[7], res[8], res[9])
+        policy_cache.put(data_ID, policy, generation=generation)
+        return policy
+
+def get_providing_policies(data_IDs):
+    policies = {}
+    missing = []
+    for data_ID in dict.fromkeys(data_IDs):
+        policy = policy_cache.get(data_ID)
+        if (policy is not None):
+            policies[data_ID] = policy
+        else:
+            missing.append(data_ID)
+    
+    if (not missing):
+        return policies
+    
+    generation = policy_cache.generation()
+    with metrics.timed("policy_lookup"), db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(SELECT_POLICIES.format(", ".join(["%s"] * len(missing))), [data_id_hash(data_ID) for data_ID in missing])
+        res = cur.fetchall()
         cur.close()
-        conn.close()
-        return DataProvidingPolcy(res[0], res[1], res[2], res[3].split(", "), res[4], res[5].split(","), res[6], res[7], res[8], res[9])
+    
+    rows = {}
+    for row in res:
+        rows.setdefault(row[2], []).append(row)
+    
+    for data_ID, matched in rows.items():
+        # same as get_providing_policy: the policy must be unique
+        if (len(matched) != 1):
+            continue
+        row = matched[0]
+        policy = DataProvidingPolcy(row[0], row[1], row[2], row[3].split(", "), row[4], row[5].split(","), row[6], row[7], row[8], row[9])
+        policy_cache.put(data_ID, policy, generation=generation)
+        policies[data_ID] = policy
+    
+    return policies
+
+def save_policies(rows):
+    # rows: key -> (usage_declaration, counter, location, duration, expiration_date)
+    params = {}
+    for key, (usage_declaration, counter, location, duration, expiration_date) in rows.items():
+        params[key] = (usage_declaration.consumer, usage_declaration.app_ID, usage_declaration.data_ID, counter, location, duration, expiration_date)
+    
+    stored = {key: False for key in rows}
+    if (not params):
+        return stored
+    
+    with metrics.timed("db_insert"), db_pool.connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.executemany(INSERT_SAVED_POLICY, list(params.values()))
+            conn.commit()
+            for key in stored:
+                stored[key] = True
+        except MySQLdb.IntegrityError:
+            # some rows already exist; store the others one by one in the same transaction
+            conn.rollback()
+            for key, param in params.items():
+                try:
+                    stored[key] = cur.execute(INSERT_SAVED_POLICY, param) == 1
+                except MySQLdb.IntegrityError:
+                    stored[key] = False
+            conn.commit()
+        cur.close()
+    
+    return stored
+
+class BoundedThreadedWSGIServer(werkzeug.serving.ThreadedWSGIServer):
+
+    def __init__(self, host, port, app, max_threads, ssl_context=None):
+        super().__init__(host, port, app, ssl_context=ssl_context)
+        self.request_slots = threading.BoundedSemaphore(max_threads)
+
+    def process_request(self, request, client_address):
+        # wait for a free slot instead of spawning unbounded threads
+        self.request_slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.request_slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.request_slots.release()
+
+def spawn_worker(server):
+    pid = os.fork()
+    if (pid == 0):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, reload_signing_material)
+        threading.Thread(target=publish_snapshots, daemon=True).start()
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    return pid
+
+def serve_production(ssl_context):
+    # the listening socket is shared by all workers; each worker accepts and
+    # completes TLS handshakes (including verify) independently
+    server = BoundedThreadedWSGIServer("0.0.0.0", int(os.environ["SERVER_PORT"]), app, SERVER_THREADS, ssl_context=ssl_context)
+    
+    # drop snapshots left by the workers of a previous run
+    shutil.rmtree(METRICS_SNAPSHOT_DIR, ignore_errors=True)
+    os.makedirs(METRICS_SNAPSHOT_DIR, mode=0o700)
+    
+    workers = [spawn_worker(server) for _ in range(SERVER_WORKERS)]
+    print(f"Started {SERVER_WORKERS} workers (threads per worker:{SERVER_THREADS}, pids:{workers})")
+    
+    def terminate(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        os._exit(0)
+    def forward_reload(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    signal.signal(signal.SIGHUP, forward_reload)
+    
+    # restart workers that exit
+    while True:
+        pid, status = os.wait()
+        if (pid in workers):
+            workers.remove(pid)
+            try:
+                os.remove(snapshot_path(pid))
+            except FileNotFoundError:
+                pass
+            print(f"Worker exited (pid:{pid}, status:{status}), restarting")
+            workers.append(spawn_worker(server))
 
 if __name__ == '__main__':
     
     get_server_cert()
     
     ssl_context = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH)
-    ssl_context.load_cert_chain("./files/server.pem", "./files/private.key")
+    ssl_context.load_cert_chain(SERVER_CERT, SIGNING_KEY)
 
     ssl_context.verify_mode = ssl.CERT_REQUIRED
     ssl_context.load_verify_locations(ROOTCA_CERT)
+    load_trust_anchors()
+    load_signing_material()
+    signal.signal(signal.SIGHUP, reload_signing_material)
     werkzeug.serving.BaseWSGIServer.verify_request = verify
 
-    app.run(debug=True, host="0.0.0.0", port=os.environ["SERVER_PORT"], ssl_context=ssl_context)
+    if (SERVER_MODE == "production"):
+        serve_production(ssl_context)
+    else:
+        app.run(debug=True, host="0.0.0.0", port=os.environ["SERVER_PORT"], ssl_context=ssl_context)